@@ -1,5 +1,7 @@
 import streamlit as st
 
+from src.utils import page_footer, session_data_version
+
 st.set_page_config(
     page_title="FuelConsumption",
     page_icon="🏠",
@@ -21,6 +23,7 @@ It contains:
 - 📈 ‎ **a dashboard** that let you see key metrics and trends
 - 🚘 ‎ **a vehicle finder** to find cars based on their characteristics
 - 💯 ‎ **an estimator of a car consumption and emissions** based on their characteristics
+- 🚚 ‎ **a fleet fuel cost calculator** for the yearly fuel use, cost and emissions of a fleet
 
 ---
 
@@ -31,3 +34,5 @@ It contains:
 - **Polars** for data manipulation
 - **Altair** for data visualization
 """
+
+page_footer(session_data_version())
@@ -0,0 +1,221 @@
+"""Load test of the local service started with `python -m src.serve`.
+
+Concurrent clients send requests over keep-alive connections for a fixed duration, and
+the latency percentiles and throughput are reported per endpoint. Prediction payloads
+and vehicle queries are sampled from the vehicles returned by the service itself.
+
+Run from the repository root while the service is running:
+
+    python benchmarks/load_test.py --endpoint predict --clients 32 --duration 10
+    python benchmarks/load_test.py --endpoint vehicles --output load.json
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+features = [
+    "make",
+    "vehicle_class",
+    "fuel_type",
+    "transmission_type",
+    "release_year",
+    "gears",
+    "engine_size",
+    "cylinders",
+]
+
+
+def _post(connection: http.client.HTTPConnection, path: str, body: Any) -> Any:
+    connection.request(
+        "POST", path, json.dumps(body), {"Content-Type": "application/json"}
+    )
+    response = connection.getresponse()
+    content = response.read()
+    if response.status != 200:
+        raise RuntimeError(f"{path} returned {response.status}: {content.decode()}")
+    return json.loads(content)
+
+
+def sample_payloads(
+    host: str, port: int, endpoint: str, vehicles_per_request: int, seed: int
+) -> list[Any]:
+    """Request bodies built from a sample of the vehicles served by `host`."""
+    connection = http.client.HTTPConnection(host, port)
+    vehicles = _post(connection, "/vehicles", {"limit": 10_000})["vehicles"]
+    connection.close()
+
+    rng = random.Random(seed)  # noqa: S311 sampling only
+    if endpoint == "predict":
+        return [
+            [
+                {feature: vehicle[feature] for feature in features}
+                for vehicle in rng.sample(vehicles, vehicles_per_request)
+            ]
+            for _ in range(1_000)
+        ]
+
+    sized_vehicles = [v for v in vehicles if v["engine_size"] is not None]
+    return [
+        {
+            "make": vehicle["make"],
+            "filters": [
+                ["fuel_type", ["is_in", [vehicle["fuel_type"]]]],
+                [
+                    "engine_size",
+                    [
+                        "is_between",
+                        vehicle["engine_size"] - 0.5,
+                        vehicle["engine_size"],
+                    ],
+                ],
+            ],
+            "limit": 100,
+        }
+        for vehicle in rng.sample(sized_vehicles, 1_000)
+    ]
+
+
+def run_client(
+    host: str,
+    port: int,
+    path: str,
+    payloads: list[Any],
+    deadline: float,
+    latencies: list[float],
+    errors: list[str],
+) -> None:
+    connection = http.client.HTTPConnection(host, port)
+    i = 0
+
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            _post(connection, path, payloads[i % len(payloads)])
+        except (OSError, RuntimeError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection(host, port)
+        else:
+            latencies.append(time.perf_counter() - start)
+        i += 1
+
+    connection.close()
+
+
+def load_test(
+    host: str,
+    port: int,
+    endpoint: str,
+    payloads: list[Any],
+    clients: int,
+    duration: float,
+) -> dict[str, float]:
+    latencies: list[float] = []
+    errors: list[str] = []
+    deadline = time.perf_counter() + duration
+
+    # Offset the payloads of each client so that they do not send the same requests
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(
+                host,
+                port,
+                f"/{endpoint}",
+                payloads[i * 7 :] + payloads[: i * 7],
+                deadline,
+                latencies,
+                errors,
+            ),
+        )
+        for i in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        logger.warning("%d failed requests, first error: %s", len(errors), errors[0])
+    if not latencies:
+        raise RuntimeError("No request succeeded")
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--endpoint", choices=["predict", "vehicles"], default="predict"
+    )
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="in seconds")
+    parser.add_argument(
+        "--vehicles-per-request",
+        type=int,
+        default=1,
+        help="vehicles scored by each prediction request",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    payloads = sample_payloads(
+        args.host, args.port, args.endpoint, args.vehicles_per_request, args.seed
+    )
+    results = load_test(
+        args.host, args.port, args.endpoint, payloads, args.clients, args.duration
+    )
+
+    logger.info(
+        "%s, %d clients: %d requests, %.0f requests/s, p50 %.2f ms, p99 %.2f ms",
+        args.endpoint,
+        args.clients,
+        results["requests"],
+        results["throughput_rps"],
+        results["p50_ms"],
+        results["p99_ms"],
+    )
+
+    connection = http.client.HTTPConnection(args.host, args.port)
+    connection.request("GET", "/health")
+    batching = json.loads(connection.getresponse().read())["batching"]
+    connection.close()
+    if args.endpoint == "predict":
+        logger.info(
+            "Server batches: %d, %.1f requests per batch on average",
+            batching["batches"],
+            batching["mean_batch_requests"],
+        )
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(vars(args) | results, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
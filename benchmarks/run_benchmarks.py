@@ -0,0 +1,365 @@
+"""Headless benchmarks of the app pages and of the data pipeline.
+
+Synthetic datasets are built by replicating the car data 1x, 10x, 100x (each copy gets
+its own model names), written as raw CSV files and processed with `src/process_data.py`.
+Each page is then run with Streamlit's `AppTest` against that dataset. The first render
+of every page runs in its own fresh process, from cold caches. Pages start preloading
+the resources of the other pages in the background, so the warm renders and the
+interactions are timed in one process once that preloading has finished.
+
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py run --scales 1 10 100 --output bench.json
+    python benchmarks/run_benchmarks.py compare baseline.json bench.json --max-regression 20
+
+`run --baseline baseline.json` runs and compares in one go. The comparison fails when a
+timing or peak memory of the baseline grows by more than `--max-regression` percent.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import runpy
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+from pathlib import Path
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+PAGES_PATH = REPO_PATH / "pages"
+
+DASHBOARD_PAGE = PAGES_PATH / "1_📈_dashboard.py"
+FINDER_PAGE = PAGES_PATH / "2_🚘_vehicle_finder.py"
+ESTIMATOR_PAGE = PAGES_PATH / "3_💯_your_car_consumption.py"
+
+PAGES = {
+    "dashboard": DASHBOARD_PAGE,
+    "finder": FINDER_PAGE,
+    "estimator": ESTIMATOR_PAGE,
+}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _timed(action: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def _median_time(actions: list[Callable[[], object]]) -> float:
+    return statistics.median(_timed(action) for action in actions)
+
+
+def write_raw_files(scale: int, raw_folder: Path) -> None:
+    """Write the car data replicated `scale` times in the format of the raw CSV files."""
+    sys.path.insert(0, str(REPO_PATH))
+    import src.process_data as process_data  # noqa: PLC0415
+    from src.utils import scan_car_data  # noqa: PLC0415
+
+    df = scan_car_data(REPO_PATH / "data", dictionary_encoded=False).collect()
+    df = pl.concat(
+        [df]
+        + [df.with_columns(pl.col("model") + f" #{copy}") for copy in range(1, scale)]
+    )
+
+    fuel_codes = {v: k for k, v in process_data.fuel_mapping.items()}
+    class_names = {k: v[0] for k, v in process_data.vehicle_class_category.items()}
+    transmission_codes = {v: k for k, v in process_data.transmission_mapping.items()}
+    raw_columns = {v: k for k, v in process_data.columns_name.items()}
+
+    raw = df.with_columns(
+        pl.col("fuel_type").replace_strict(fuel_codes),
+        pl.col("vehicle_class").replace_strict(class_names),
+        (
+            pl.col("transmission_type").replace_strict(transmission_codes)
+            + pl.col("gears").cast(pl.String).fill_null("")
+        ).alias("transmission_info"),
+    ).select(list(raw_columns))
+
+    raw_folder.mkdir(parents=True)
+    raw.rename(raw_columns).filter(pl.col("Model year") < 2015).write_csv(
+        raw_folder / "1995-2014-car-data.csv"
+    )
+    raw.rename(raw_columns).filter(pl.col("Model year") >= 2015).write_csv(
+        raw_folder / "2015-2024-car-data.csv"
+    )
+
+
+def run_process_data() -> dict[str, float]:
+    """Run the data pipeline from scratch in the current working directory."""
+    seconds = _timed(
+        lambda: runpy.run_path(
+            str(REPO_PATH / "src" / "process_data.py"), run_name="__main__"
+        )
+    )
+    return {"process_data.seconds": seconds, "process_data.peak_rss_mb": _peak_rss_mb()}
+
+
+def run_first_render(page: str) -> dict[str, float]:
+    """Time the first render of `page`, run in a fresh process from cold caches."""
+    from streamlit.testing.v1 import AppTest  # noqa: PLC0415
+
+    app = AppTest.from_file(str(PAGES[page]), default_timeout=600)
+    seconds = _timed(app.run)
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+
+    return {f"{page}.first_render_s": seconds}
+
+
+def _wait_for_preloading() -> None:
+    """Load every preloaded resource, as the first page opened does in the background."""
+    from src.utils import start_data_watcher, start_preloading  # noqa: PLC0415
+
+    preloader = start_preloading(start_data_watcher().current)
+    for future in preloader.futures.values():
+        future.result()
+
+
+def run_pages(repeat: int) -> dict[str, float]:
+    """Time the warm render and typical interactions of every page, once preloaded."""
+    from streamlit.testing.v1 import AppTest  # noqa: PLC0415
+
+    _wait_for_preloading()
+    results = {}
+
+    dashboard = AppTest.from_file(str(DASHBOARD_PAGE), default_timeout=600)
+    results["dashboard.warm_render_s"] = _timed(dashboard.run)
+    fuel_types = dashboard.selectbox[0].options
+    vehicle_classes = dashboard.selectbox[1].options
+    results["dashboard.fuel_type_change_s"] = _median_time(
+        [
+            lambda i=i: (
+                dashboard.selectbox[0].set_value(fuel_types[i % len(fuel_types)]).run()
+            )
+            for i in range(1, repeat + 1)
+        ]
+    )
+    results["dashboard.vehicle_class_change_s"] = _median_time(
+        [
+            lambda i=i: (
+                dashboard.selectbox[1]
+                .set_value(vehicle_classes[i % len(vehicle_classes)])
+                .run()
+            )
+            for i in range(1, repeat + 1)
+        ]
+    )
+
+    finder = AppTest.from_file(str(FINDER_PAGE), default_timeout=600)
+    results["finder.warm_render_s"] = _timed(finder.run)
+    results["finder.add_filters_s"] = _timed(
+        lambda: (
+            finder.multiselect[0]
+            .set_value(["Fuel Type", "Engine size (L)", "Release year"])
+            .run()
+        )
+    )
+    results["finder.slider_change_s"] = _median_time(
+        [
+            lambda i=i: finder.slider[0].set_value((1.0 + i / 10, 4.0)).run()
+            for i in range(repeat)
+        ]
+    )
+    results["finder.fuel_type_change_s"] = _median_time(
+        [
+            lambda i=i: (
+                finder.multiselect[1]
+                .set_value(finder.multiselect[1].options[: 1 + i % 3])
+                .run()
+            )
+            for i in range(repeat)
+        ]
+    )
+    results["finder.make_change_s"] = _median_time(
+        [
+            lambda make=make: finder.selectbox[0].set_value(make).run()
+            for make in finder.selectbox[0].options[:repeat]
+        ]
+    )
+
+    estimator = AppTest.from_file(str(ESTIMATOR_PAGE), default_timeout=600)
+    results["estimator.warm_render_s"] = _timed(estimator.run)
+    results["estimator.prediction_s"] = _median_time(
+        [
+            lambda i=i: estimator.slider[0].set_value(1.0 + i / 10).run()
+            for i in range(repeat)
+        ]
+    )
+
+    for page in (dashboard, finder, estimator):
+        if page.exception:
+            raise RuntimeError(page.exception[0].message)
+
+    results["pages.peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def _run_worker(
+    task: str, work_dir: Path, repeat: int, backend: str, page: str | None = None
+) -> dict:
+    result_path = work_dir / f"{task}{f'.{page}' if page else ''}.json"
+    env = os.environ | {
+        "PYTHONPATH": str(REPO_PATH),
+        "FUEL_APP_DATA_BACKEND": backend,
+    }
+    subprocess.run(  # noqa: S603 runs this very script
+        [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "worker",
+            task,
+            str(result_path),
+            "--repeat",
+            str(repeat),
+            *(["--page", page] if page else []),
+        ],
+        cwd=work_dir,
+        env=env,
+        check=True,
+    )
+    return json.loads(result_path.read_text())
+
+
+def run(scales: list[int], repeat: int, backend: str) -> dict:
+    results = {}
+
+    for scale in scales:
+        work_dir = Path(tempfile.mkdtemp(prefix=f"fuel-bench-{scale}x-"))
+        try:
+            write_raw_files(scale, work_dir / "data" / "raw")
+            for artifact in ("lasso_regression.json", "lasso_regression.npz"):
+                shutil.copy(REPO_PATH / "data" / artifact, work_dir / "data")
+
+            scale_results = _run_worker("process_data", work_dir, repeat, backend)
+            for page in PAGES:
+                scale_results |= _run_worker(
+                    "first_render", work_dir, repeat, backend, page
+                )
+            scale_results |= _run_worker("pages", work_dir, repeat, backend)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        for name, value in scale_results.items():
+            logger.info("%4dx %-36s %10.4f", scale, name, value)
+        results[f"{scale}x"] = scale_results
+
+    return {
+        "meta": {
+            "date": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "polars": pl.__version__,
+            "platform": platform.platform(),
+            "backend": backend,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, max_regression: float) -> list[str]:
+    """List the benchmarks of `current` more than `max_regression` percent above baseline."""
+    regressions = []
+
+    for scale, benchmarks in current["results"].items():
+        for name, value in benchmarks.items():
+            reference = baseline["results"].get(scale, {}).get(name)
+            if not reference:
+                continue
+
+            change = (value - reference) / reference * 100
+            logger.info(
+                "%5s %-36s %10.4f -> %10.4f (%+6.1f%%)",
+                scale,
+                name,
+                reference,
+                value,
+                change,
+            )
+            if change > max_regression:
+                regressions.append(f"{scale} {name}: {change:+.1f}%")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--backend", choices=["memory", "lazy"], default="memory")
+    run_parser.add_argument("--output", type=Path, default=Path("bench.json"))
+    run_parser.add_argument("--baseline", type=Path)
+    run_parser.add_argument("--max-regression", type=float, default=20.0)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument("--max-regression", type=float, default=20.0)
+
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument(
+        "task", choices=["process_data", "first_render", "pages"]
+    )
+    worker_parser.add_argument("result_path", type=Path)
+    worker_parser.add_argument("--repeat", type=int, default=5)
+    worker_parser.add_argument("--page", choices=list(PAGES))
+
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        if args.task == "process_data":
+            results = run_process_data()
+        elif args.task == "first_render":
+            results = run_first_render(args.page)
+        else:
+            results = run_pages(args.repeat)
+        args.result_path.write_text(json.dumps(results))
+        return
+
+    if args.command == "run":
+        current = run(args.scales, args.repeat, args.backend)
+        args.output.write_text(json.dumps(current, indent=2))
+        logger.info("Results written to %s", args.output)
+        baseline_path = args.baseline
+    else:
+        current = json.loads(args.current.read_text())
+        baseline_path = args.baseline
+
+    if baseline_path is None:
+        return
+
+    regressions = compare(
+        json.loads(baseline_path.read_text()), current, args.max_regression
+    )
+    if regressions:
+        logger.error(
+            "Regressions above %.0f%%:\n%s", args.max_regression, "\n".join(regressions)
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
@@ -1,8 +1,15 @@
-import altair as alt
-import polars as pl
 import streamlit as st
 
-from src.utils import load_car_data, percentage_change
+from src.utils import (
+    dashboard_chart_specs,
+    load_kpi_index,
+    page_footer,
+    percentage_change,
+    profiled_fragment,
+    session_data_version,
+    span,
+    start_profiling,
+)
 
 st.set_page_config(
     page_title="Fuel consumption - Dashboard", page_icon="📈", layout="wide"
@@ -10,255 +17,163 @@ st.set_page_config(
 
 st.title("📈 Dashboard")
 
-df = load_car_data()
+start_profiling("dashboard")
+
+version = session_data_version()
+
+with span("load_kpi_index"):
+    kpis = load_kpi_index(version)
 
 # -------------- Metric --------------
 
-# Group by year and calculate the required metrics
-metrics = (
-    df.group_by("release_year")
-    .agg(
-        model_count=pl.len(),
-        fc_mixed=pl.col("fc_mixed").mean(),
-        emissions=pl.col("emissions").mean(),
+
+def show_metrics(current: dict, previous: dict | None) -> None:
+    """Show the KPIs of a slice of the cube, compared with a previous slice if any."""
+    compared = (
+        current["model_count"] > 0
+        and previous is not None
+        and previous["model_count"] > 0
+    )
+    col1, col2, col3 = st.columns(3)
+
+    if not current["model_count"]:
+        col1.metric(label="Number of models", value="0 models")
+        col2.metric(label="Average consumption", value="-")
+        col3.metric(label="Average emissions", value="-")
+        return
+
+    col1.metric(
+        label="Number of models",
+        value=f"{current['model_count']:.0f} models",
+        delta=f"{percentage_change(current['model_count'], previous['model_count']):.1%}"
+        if compared
+        else None,
+    )
+
+    # Means are None when every value of the measure is missing
+    def has_mean(measure: str) -> bool:
+        return current[measure] is not None
+
+    def compared_mean(measure: str) -> bool:
+        return compared and has_mean(measure) and previous[measure] is not None
+
+    col2.metric(
+        label="Average consumption",
+        value=f"{current['fc_mixed']:.1f}L/100km" if has_mean("fc_mixed") else "-",
+        delta=f"{current['fc_mixed'] - previous['fc_mixed']:.2f}L"
+        if compared_mean("fc_mixed")
+        else None,
+        delta_color="inverse",
+    )
+
+    col3.metric(
+        label="Average emissions",
+        value=f"{current['emissions']:.0f}g/km" if has_mean("emissions") else "-",
+        delta=f"{percentage_change(current['emissions'], previous['emissions']):.2%}"
+        if compared_mean("emissions")
+        else None,
+        delta_color="inverse",
     )
-    .sort("release_year", descending=True)
-)
-current_year = metrics.row(0, named=True)
-previous_year = metrics.row(1, named=True)
+
 
 # Display metrics
 st.header("Overview - Year on Year")
 
-col1, col2, col3 = st.columns(3)
+with span("kpis.year_on_year"):
+    current_year = kpis.query(kpis.years[-1], kpis.years[-1])
+    previous_year = kpis.query(kpis.years[-2], kpis.years[-2])
+show_metrics(current_year, previous_year)
 
-col1.metric(
-    label="Number of models",
-    value=f"{current_year['model_count']:.0f} models",
-    delta=f"{percentage_change(current_year['model_count'], previous_year['model_count']):.1%}",
-)
+st.header("Overview - Custom selection")
 
-col2.metric(
-    label="Average consumption",
-    value=f"{current_year['fc_mixed']:.1f}L/100km",
-    delta=f"{current_year['fc_mixed'] - previous_year['fc_mixed']:.2f}L",
-    delta_color="inverse",
-)
 
-col3.metric(
-    label="Average emissions",
-    value=f"{current_year['emissions']:.0f}g/km",
-    delta=f"{percentage_change(current_year['emissions'], previous_year['emissions']):.2%}",
-    delta_color="inverse",
-)
+# The selection widgets only rerun their own metrics
+@profiled_fragment
+def custom_overview() -> None:
+    col1, col2, col3 = st.columns(3)
+    first_year, last_year = col1.slider(
+        "Release years",
+        min_value=kpis.years[0],
+        max_value=kpis.years[-1],
+        value=(kpis.years[-10], kpis.years[-1]),
+    )
+    vehicle_classes = col2.multiselect(
+        "Vehicle types", kpis.vehicle_classes, placeholder="All vehicle types"
+    )
+    fuel_types = col3.multiselect(
+        "Fuel types", kpis.fuel_types, placeholder="All fuel types"
+    )
+
+    # Compared with the same number of years right before, when the data covers them
+    # all, otherwise the previous window would be shorter
+    length = last_year - first_year + 1
+    with span("kpis.custom"):
+        current = kpis.query(
+            first_year, last_year, vehicle_classes or None, fuel_types or None
+        )
+        previous = (
+            kpis.query(
+                first_year - length,
+                first_year - 1,
+                vehicle_classes or None,
+                fuel_types or None,
+            )
+            if first_year - length >= kpis.years[0]
+            else None
+        )
+    show_metrics(current, previous)
+    if current["model_count"] and previous and previous["model_count"]:
+        st.caption(
+            f"Compared with {first_year - length}-{first_year - 1}"
+            if length > 1
+            else f"Compared with {first_year - 1}"
+        )
+
+
+custom_overview()
 
 # ------------- Plotting -------------
 
-# Compute year for axis values
-axis_year_values = df.get_column("release_year").unique().sort().to_list()[::2]
-
-# Model count over time
-temp = df.group_by("release_year").len("model_count")
-
-chart = (
-    alt.Chart(temp)
-    .mark_line()
-    .encode(
-        x=alt.X(
-            "release_year:O",
-            title="Year",
-            axis=alt.Axis(
-                labelAngle=0,
-                values=axis_year_values,
-            ),
-        ),
-        y=alt.Y("model_count:Q", title=None),
-        tooltip=[
-            alt.Tooltip("release_year:O", title="Year"),
-            alt.Tooltip("model_count:Q", title="Number of models"),
-        ],
-    )
-    .properties(title="Number of models released over time")
-)
-st.altair_chart(chart, width="stretch")
-
-# Proportion of vehicle class over time
-temp = (
-    df.group_by(["release_year", "vehicle_class"])
-    .agg(model_count=pl.len())
-    .with_columns(
-        proportion=pl.col("model_count")
-        / pl.col("model_count").sum().over("release_year")
-    )
-)
+# Specs of every chart and selection, built once per version of the data
+with span("chart_specs"):
+    chart_specs = dashboard_chart_specs(version)
 
-chart = (
-    alt.Chart(temp)
-    .mark_area()
-    .encode(
-        x=alt.X(
-            "release_year:O",
-            title="Year",
-            axis=alt.Axis(
-                labelAngle=0,
-                values=axis_year_values,
-            ),
-        ),
-        y=alt.Y(
-            "proportion:Q",
-            title="Proportion of Vehicle Class",
-            axis=alt.Axis(format="%"),
-        ),
-        color=alt.Color("vehicle_class:N", title="Vehicle Class"),
-        tooltip=[
-            alt.Tooltip("release_year:O", title="Year"),
-            alt.Tooltip("vehicle_class:N", title="Vehicle Class"),
-            alt.Tooltip("proportion:Q", title="Proportion", format=".2%"),
-        ],
-    )
-    .properties(title="Vehicle Class Proportion Over Time")
-)
-st.altair_chart(chart, width="stretch")
-
-# Proportion of vehicle fuel type over time
-temp = (
-    df.group_by(["release_year", "fuel_type"])
-    .agg(model_count=pl.len())
-    .with_columns(
-        proportion=pl.col("model_count")
-        / pl.col("model_count").sum().over("release_year")
-    )
-)
+with span("chart.model_count"):
+    st.vega_lite_chart(chart_specs[("model_count", None)], width="stretch")
 
-chart_fuel = (
-    alt.Chart(temp)
-    .mark_bar()
-    .encode(
-        x=alt.X(
-            "release_year:O",
-            title="Year",
-            axis=alt.Axis(labelAngle=0, values=axis_year_values),
-        ),
-        y=alt.Y(
-            "proportion:Q", title="Percentage of Fuel Type", axis=alt.Axis(format="%")
-        ),
-        color=alt.Color("fuel_type:N", title="Fuel Type"),
-        tooltip=[
-            alt.Tooltip("release_year:O", title="Year"),
-            alt.Tooltip("fuel_type:N", title="Fuel Type"),
-            alt.Tooltip("proportion:Q", title="Percentage", format=".2%"),
-        ],
-    )
-    .properties(title="Vehicle Fuel Type Proportion Over Time")
-)
-st.altair_chart(chart_fuel, width="stretch")
-
-# Fuel type proportion versus vehicle type
-temp = (
-    df.group_by(["vehicle_class", "fuel_type"])
-    .agg(model_count=pl.len())
-    .with_columns(
-        proportion=pl.col("model_count")
-        / pl.col("model_count").sum().over("vehicle_class")
-    )
-)
+with span("chart.vehicle_class"):
+    st.vega_lite_chart(chart_specs[("vehicle_class", None)], width="stretch")
 
-# Order vehicle classes by count
-order = (
-    df.group_by("vehicle_class")
-    .len()
-    .sort("len", descending=True)
-    .get_column("vehicle_class")
-    .to_list()
-)
+with span("chart.fuel_type"):
+    st.vega_lite_chart(chart_specs[("fuel_type", None)], width="stretch")
 
-chart_fuel = (
-    alt.Chart(temp)
-    .mark_bar()
-    .encode(
-        x=alt.X(
-            "proportion:Q", title="Fuel Type Proportion", axis=alt.Axis(format="%")
-        ),
-        y=alt.Y("vehicle_class:O", sort=order, title=None),
-        color=alt.Color("fuel_type:N", title="Fuel Type"),
-        tooltip=[
-            alt.Tooltip("vehicle_class:O", title="Vehicle Type"),
-            alt.Tooltip("fuel_type:N", title="Fuel Type"),
-            alt.Tooltip("proportion:Q", title="Percentage", format=".2%"),
-        ],
-    )
-    .properties(title="Fuel Type Proportion versus Vehicle Type")
-)
-st.altair_chart(chart_fuel, width="stretch")
+with span("chart.fuel_by_class"):
+    st.vega_lite_chart(chart_specs[("fuel_by_class", None)], width="stretch")
 
 st.markdown("### Vehicle emissions")
 
-# Vehicle emissions over time for a specific fuel type
-fuel_type = st.selectbox(
-    "Select a fuel type", df.get_column("fuel_type").unique().sort(), index=0
-)
 
-temp = (
-    df.filter(pl.col("fuel_type") == fuel_type)
-    .group_by(["release_year", "vehicle_class"])
-    .agg(emissions=pl.col("emissions").mean())
-)
+# Each selectbox only reruns its own chart
+@profiled_fragment
+def emissions_chart(chart_id: str, label: str, options: list[str]) -> None:
+    selection = st.selectbox(label, options, index=0)
 
-chart_emissions = (
-    alt.Chart(temp)
-    .mark_line()
-    .encode(
-        x=alt.X(
-            "release_year:O",
-            title="Year",
-            axis=alt.Axis(
-                labelAngle=0,
-                values=axis_year_values,
-            ),
-        ),
-        y=alt.Y("emissions:Q", title="Emissions (g/km)"),
-        color=alt.Color("vehicle_class:N", title="Vehicle Type"),
-        tooltip=[
-            alt.Tooltip("release_year:O", title="Year"),
-            alt.Tooltip("vehicle_class:N", title="Vehicle Type"),
-            alt.Tooltip("emissions:Q", title="Emissions (g/km)", format=".2f"),
-        ],
-    )
-    .properties(title=f"Average Emissions by Vehicle Type for {fuel_type}")
-)
-st.altair_chart(chart_emissions, width="stretch")
+    with span(f"chart.{chart_id}"):
+        st.vega_lite_chart(chart_specs[(chart_id, selection)], width="stretch")
 
-# Vehicle emissions over time for a specific vehicle class
-vehicle_class = st.selectbox(
-    "Select a vehicle type", df.get_column("vehicle_class").unique().sort(), index=0
-)
 
-temp = (
-    df.filter(pl.col("vehicle_class") == vehicle_class)
-    .group_by(["release_year", "fuel_type"])
-    .agg(emissions=pl.col("emissions").mean())
+# Vehicle emissions over time for a specific fuel type
+emissions_chart(
+    "emissions_by_class",
+    "Select a fuel type",
+    kpis.fuel_types,
 )
 
-chart_emissions = (
-    alt.Chart(temp)
-    .mark_line()
-    .encode(
-        x=alt.X(
-            "release_year:O",
-            title="Year",
-            axis=alt.Axis(
-                labelAngle=0,
-                values=axis_year_values,
-            ),
-        ),
-        y=alt.Y("emissions:Q", title="Emissions (g/km)"),
-        color=alt.Color("fuel_type:N", title="Fuel Type"),
-        tooltip=[
-            alt.Tooltip("release_year:O", title="Year"),
-            alt.Tooltip("fuel_type:N", title="Fuel Type"),
-            alt.Tooltip("emissions:Q", title="Emissions (g/km)", format=".2f"),
-        ],
-    )
-    .properties(title=f"Average Emissions by Fuel Type for {vehicle_class}")
+# Vehicle emissions over time for a specific vehicle class
+emissions_chart(
+    "emissions_by_fuel",
+    "Select a vehicle type",
+    kpis.vehicle_classes,
 )
-st.altair_chart(chart_emissions, width="stretch")
+
+page_footer(version)
@@ -1,7 +1,17 @@
-import polars as pl
 import streamlit as st
 
-from src.utils import dataframe_explorer, display_columns_name_mapping, load_car_data
+from src.utils import (
+    DATA_BACKEND,
+    dataframe_explorer,
+    display_columns_name_mapping,
+    load_option_index,
+    load_search_index,
+    page_footer,
+    query_car_data,
+    session_data_version,
+    span,
+    start_profiling,
+)
 
 st.set_page_config(
     page_title="Vehicle finder",
@@ -14,33 +24,92 @@ st.title("🚘 Vehicle finder")
 
 st.markdown("Find a vehicle from it's caracteristics")
 
-# Load and preprocess data
-df = load_car_data()
+start_profiling("vehicle_finder")
+
+version = session_data_version()
+
+# Dropdown options come from the option index built once per data version
+with span("load_option_index"):
+    index = load_option_index(version)
+
+
+def select_search_match() -> None:
+    make, model = st.session_state["finder_search_match"]
+    st.session_state["finder_make"] = make
+    st.session_state["finder_model"] = model
 
-df = df.rename(display_columns_name_mapping)
+
+# Typo-tolerant search filling the Make and Model filters
+search = st.text_input(
+    "Search a make or model", placeholder="e.g. mercedes c300, F150, toyta camry"
+)
+if search:
+    with span("search_index"):
+        matches = load_search_index(version).search(search)
+
+    if matches:
+        st.radio(
+            "Best matches",
+            matches,
+            format_func=lambda match: " ".join(filter(None, match)),
+            index=None,
+            horizontal=True,
+            key="finder_search_match",
+            on_change=select_search_match,
+        )
+    else:
+        st.caption("No make or model looks like this search.")
 
 # Manual Filters for Make and Model
 col1, col2 = st.columns(2)
 with col1:
     selected_make = st.selectbox(
-        "Make", df["Make"].unique().sort(), index=None, placeholder="Select a make"
+        "Make",
+        index.options["make"],
+        index=None,
+        placeholder="Select a make",
+        key="finder_make",
     )
-    if selected_make:
-        df = df.filter(pl.col("Make") == selected_make)
 
 with col2:
+    models = (
+        index.models_by_make.get(selected_make, [])
+        if selected_make
+        else index.options["model"]
+    )
     selected_model = st.selectbox(
-        "Model", df["Model"].unique().sort(), index=None, placeholder="Select a model"
+        "Model", models, index=None, placeholder="Select a model", key="finder_model"
     )
-    if selected_model:
-        df = df.filter(pl.col("Model") == selected_model)
+
+# Load and preprocess data, filters are applied lazily before collecting
+with span("query_car_data"):
+    lf = query_car_data(version, make=selected_make, model=selected_model)
+
+lf = lf.rename(display_columns_name_mapping)
+
+# Out-of-core datasets can hold far more rows than the table can show
+max_rows = 10_000 if DATA_BACKEND == "lazy" else None
 
 # Automatic filters
-df = dataframe_explorer(df, excluded_columns=["Make", "Model"])
+with span("dataframe_explorer"):
+    df = dataframe_explorer(
+        lf,
+        excluded_columns=["Make", "Model"],
+        max_rows=max_rows,
+        # Sessions with the same make, model and filters share their results
+        cache_key=("car_data", version, selected_make, selected_model),
+        export_file_name="vehicles",
+    )
+
+if max_rows is not None and len(df) == max_rows:
+    st.caption(f"Showing the first {max_rows:,} matching vehicles.")
 
 # Display the final dataframe
-st.dataframe(
-    df,
-    width="stretch",
-    hide_index=True,
-)
+with span("render_table"):
+    st.dataframe(
+        df,
+        width="stretch",
+        hide_index=True,
+    )
+
+page_footer(version)
@@ -1,7 +1,18 @@
-import polars as pl
 import streamlit as st
 
-from src.utils import load_car_data, load_model
+from src.utils import (
+    display_columns_name_mapping,
+    load_model,
+    load_neighbor_index,
+    load_option_index,
+    page_footer,
+    profiled_fragment,
+    sensitivity_chart_specs,
+    session_data_version,
+    span,
+    start_preloading,
+    start_profiling,
+)
 
 st.set_page_config(
     page_title="Your vehicle consumption",
@@ -15,65 +26,127 @@ st.write(
     "Give us some informations about your vehicle and we will estimate its fuel consumption and CO2 emissions."
 )
 
-df = load_car_data()
+start_profiling("consumption_estimator")
+
+version = session_data_version()
+
+# Options and ranges are looked up in the option index built once per data version
+with span("load_option_index"):
+    index = load_option_index(version)
 
 col1, col2 = st.columns(2)
 with col1:
-    make = st.selectbox(label="Make", options=df["make"].unique().sort())
+    make = st.selectbox(label="Make", options=index.options["make"])
     release_year = st.selectbox(label="Release year", options=range(2025, 1979, -1))
     transmission_type = st.selectbox(
-        label="Transmission type", options=df["transmission_type"].unique().sort()
+        label="Transmission type", options=index.options["transmission_type"]
     )
     engine_size = st.slider(
         label="Engine size (L)",
-        min_value=float(df["engine_size"].min()),
-        max_value=float(df["engine_size"].max()),
+        min_value=float(index.bounds["engine_size"][0]),
+        max_value=float(index.bounds["engine_size"][1]),
         value=2.0,
         step=0.1,
         format="%.1f L",
     )
 with col2:
     vehicle_class = st.selectbox(
-        label="Vehicle class", options=df["vehicle_class"].unique().sort()
+        label="Vehicle class", options=index.options["vehicle_class"]
     )
-    fuel = st.selectbox(label="Fuel type", options=df["fuel_type"].unique().sort())
+    fuel = st.selectbox(label="Fuel type", options=index.options["fuel_type"])
     gears = st.slider(
         label="Gears",
-        min_value=int(df["gears"].min()),
-        max_value=int(df["gears"].max()),
+        min_value=int(index.bounds["gears"][0]),
+        max_value=int(index.bounds["gears"][1]),
         value=5,
         step=1,
         format="%.0f",
     )
     cylinders = st.slider(
         label="Cylinders",
-        min_value=int(df["cylinders"].min()),
-        max_value=int(df["cylinders"].max()),
+        min_value=int(index.bounds["cylinders"][0]),
+        max_value=int(index.bounds["cylinders"][1]),
         value=4,
         step=1,
     )
 
 car_features = {
-    "make": [make],
-    "release_year": [int(release_year)],
-    "vehicle_class": [vehicle_class],
-    "fuel_type": [fuel],
-    "transmission_type": [transmission_type],
-    "gears": [None if transmission_type == "Continuously variable" else gears],
-    "engine_size": [float(engine_size)],
-    "cylinders": [int(cylinders)],
+    "make": make,
+    "release_year": int(release_year),
+    "vehicle_class": vehicle_class,
+    "fuel_type": fuel,
+    "transmission_type": transmission_type,
+    "gears": None if transmission_type == "Continuously variable" else gears,
+    "engine_size": float(engine_size),
+    "cylinders": int(cylinders),
 }
 
-car_features_df = pl.DataFrame(car_features)
-
 # Load model
-model = load_model()
+with span("load_model"):
+    model = load_model(version)
 
 # Predict
-result = model.predict(car_features_df).reshape(-1)
+with span("predict"):
+    result = model.predict_one(car_features)
 
 st.header("Estimate")
 st.markdown(f"#### 💨 &nbsp; Emissions : {result[0]:.0f} g/km")
 st.markdown(f"#### 🔃 &nbsp; Mixed consumption : {result[1]:.1f} L/100 km")
 st.markdown(f"#### 🏙️ &nbsp; City consumption : {result[2]:.1f} L/100 km")
 st.markdown(f"#### 🛣️ &nbsp; Highway consumption : {result[3]:.1f} L/100 km")
+
+# What-if curves, varying one characteristic with the others held fixed
+st.header("What if?")
+
+# Specs of the curves of every feature, built once per vehicle
+with span("sensitivity_chart_specs"):
+    sensitivity_specs = sensitivity_chart_specs(car_features, version)
+
+tabs = st.tabs(["Engine size", "Cylinders", "Gears", "Release year"])
+for tab, feature in zip(
+    tabs, ["engine_size", "cylinders", "gears", "release_year"], strict=True
+):
+    with tab:
+        if (feature, "consumption") not in sensitivity_specs:
+            st.caption("Gears do not apply to continuously variable transmissions.")
+            continue
+
+        with span(f"chart.sensitivity_{feature}"):
+            st.vega_lite_chart(
+                sensitivity_specs[(feature, "consumption")], width="stretch"
+            )
+        with span(f"chart.sensitivity_{feature}_emissions"):
+            st.vega_lite_chart(
+                sensitivity_specs[(feature, "emissions")], width="stretch"
+            )
+
+# Real vehicles closest to the described one, as seen by the model. The index is built
+# in the background, so the section waits for it instead of building it on this rerun
+st.header("Similar vehicles")
+
+preloader = start_preloading(version)
+index_pending = "similar vehicles index" in preloader.pending()
+
+
+@profiled_fragment(run_every=1 if index_pending else None)
+def similar_vehicles() -> None:
+    if "similar vehicles index" in preloader.pending():
+        st.caption("⏳ Indexing the vehicles, they will show up in a few seconds.")
+        return
+    if index_pending:
+        # Rerun the page so that the fragment stops polling
+        st.rerun()
+
+    with span("similar_vehicles"):
+        similar = load_neighbor_index(version).query(car_features, k=5)
+
+    st.dataframe(
+        similar.drop("distance").rename(display_columns_name_mapping, strict=False),
+        width="stretch",
+        hide_index=True,
+    )
+
+
+similar_vehicles()
+
+page_footer(version)
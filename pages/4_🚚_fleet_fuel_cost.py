@@ -0,0 +1,130 @@
+import polars as pl
+import streamlit as st
+
+from src.utils import (
+    display_columns_name_mapping,
+    fleet_columns,
+    fleet_fuel_cost,
+    load_fleet_catalogue,
+    page_footer,
+    session_data_version,
+    span,
+    start_profiling,
+)
+
+st.set_page_config(
+    page_title="Fuel consumption - Fleet fuel cost", page_icon="🚚", layout="wide"
+)
+
+st.title("🚚 Fleet fuel cost")
+st.write(
+    "Upload your fleet and we will compute the yearly fuel use, fuel cost and CO2 emissions of every vehicle."
+)
+
+start_profiling("fleet_fuel_cost")
+
+version = session_data_version()
+
+# Vehicles scored at once, between two updates of the progress bar
+chunk_size = 50_000
+
+st.caption(
+    "The file needs the columns "
+    + ", ".join(f"`{column}`" for column in fleet_columns)
+    + " (kilometers per year and price per litre). Vehicles missing from our data are "
+    "estimated by the model, using the columns `vehicle_class`, `fuel_type`, "
+    "`transmission_type`, `engine_size`, `cylinders` and `gears` when the file has them."
+)
+uploaded_file = st.file_uploader("Fleet file", type=["csv", "parquet"])
+
+if uploaded_file is None:
+    page_footer(version)
+    st.stop()
+
+# Results are kept in the session until another file is uploaded or the data updated
+result_key = (uploaded_file.file_id, version)
+result = st.session_state.get("fleet_result")
+if result is None or result[0] != result_key:
+    try:
+        with span("read_fleet"):
+            fleet = (
+                pl.read_parquet(uploaded_file)
+                if uploaded_file.name.endswith(".parquet")
+                else pl.read_csv(uploaded_file)
+            )
+
+        with span("load_fleet_catalogue"):
+            load_fleet_catalogue(version)
+
+        progress = st.progress(0.0, text="Computing the fuel cost of the fleet")
+        chunks = []
+        with span("fleet_fuel_cost"):
+            for chunk in fleet.iter_slices(chunk_size):
+                chunks.append(fleet_fuel_cost(chunk, version))
+                done = sum(map(len, chunks))
+                progress.progress(
+                    done / len(fleet), text=f"{done:,} of {len(fleet):,} vehicles"
+                )
+        progress.empty()
+    except (ValueError, pl.exceptions.PolarsError) as e:
+        st.error(f"Cannot process {uploaded_file.name}: {e}")
+        page_footer(version)
+        st.stop()
+
+    result = (result_key, pl.concat(chunks) if chunks else None)
+    st.session_state["fleet_result"] = result
+
+vehicles = result[1]
+if vehicles is None:
+    st.warning(f"{uploaded_file.name} holds no vehicle.")
+    page_footer(version)
+    st.stop()
+
+# -------------- Totals --------------
+
+st.header("Fleet")
+
+totals = vehicles.select(
+    pl.len().alias("vehicles"),
+    (pl.col("source") == "catalogue").mean().alias("matched"),
+    pl.col("fuel_l", "fuel_cost", "co2_kg").sum(),
+).row(0, named=True)
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric(
+    label="Vehicles",
+    value=f"{totals['vehicles']:,}",
+    help=f"{totals['matched']:.1%} found in our data, the others are estimated",
+)
+col2.metric(label="Fuel use", value=f"{totals['fuel_l']:,.0f} L/year")
+col3.metric(label="Fuel cost", value=f"{totals['fuel_cost']:,.0f} /year")
+col4.metric(label="CO2 emissions", value=f"{totals['co2_kg'] / 1000:,.1f} t/year")
+
+# -------------- Vehicles --------------
+
+st.header("Vehicles")
+
+# Showing every vehicle of a large fleet would be slow to send to the browser
+max_rows = 10_000
+if len(vehicles) > max_rows:
+    st.caption(f"First {max_rows:,} of {len(vehicles):,} vehicles")
+
+with span("render_table"):
+    st.dataframe(
+        vehicles.head(max_rows).rename(
+            {
+                **display_columns_name_mapping,
+                "annual_km": "Kilometers per year",
+                "fuel_price": "Fuel price (per L)",
+                "source": "Source",
+                "fuel_l": "Fuel use (L/year)",
+                "fuel_cost": "Fuel cost (per year)",
+                "co2_kg": "CO2 emissions (kg/year)",
+            },
+            strict=False,
+        ),
+        width="stretch",
+        hide_index=True,
+    )
+
+page_footer(version)
@@ -0,0 +1,69 @@
+"""Export the pickled Lasso pipeline as the model artifact loaded by the app.
+
+Run from the repository root with `python -m src.export_model`. The artifact is a JSON
+manifest (feature layout, categories, imputer and scaler statistics, targets and the
+hash of the car data) next to `.npz` coefficient arrays, which `LinearScorer` reads
+without scikit-learn. The export fails if the artifact does not reproduce the
+pipeline's predictions on the whole car dataset.
+"""
+
+import logging
+import pickle
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from src.scorer import LinearScorer
+from src.utils import dataset_hash, scan_car_data
+
+logger = logging.getLogger(__name__)
+
+model_path = Path("./data/lasso_regression.pkl")
+scorer_path = Path("./data/lasso_regression.json")
+
+targets = ["emissions", "fc_mixed", "fc_city", "fc_highway"]
+
+
+def check_parity(
+    scorer: LinearScorer, pipeline, df: pl.DataFrame, tolerance: float = 1e-6
+) -> float:
+    """Compare the scorer with the pipeline on `df`, both row-wise and in batch."""
+    expected = pipeline.predict(df).reshape(len(df), -1)
+    batch = scorer.predict_frame(df).to_numpy()
+    single = np.array(
+        [
+            scorer.predict_one(row)
+            for row in df.select(scorer.features).iter_rows(named=True)
+        ]
+    )
+
+    max_error = float(
+        max(np.abs(batch - expected).max(), np.abs(single - expected).max())
+    )
+    if max_error > tolerance:
+        raise ValueError(
+            f"Flattened scorer differs from the pipeline by up to {max_error:.3g}"
+        )
+
+    return max_error
+
+
+def main() -> None:
+    with model_path.open("rb") as f:
+        pipeline = pickle.load(f)  # noqa: S301 deserialization is safe here
+
+    LinearScorer.from_pipeline(pipeline, targets).save(scorer_path, dataset_hash())
+
+    # Check the artifact as the app loads it
+    scorer = LinearScorer.load(scorer_path)
+    max_error = check_parity(scorer, pipeline, scan_car_data().collect())
+
+    logger.info(
+        "Exported %s (max deviation from the pipeline: %.3g)", scorer_path, max_error
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,31 @@
+"""Score a fleet file with the trained model.
+
+Run from the repository root, e.g. `python -m src.predict_batch fleet.csv predictions.parquet`.
+"""
+
+import argparse
+import logging
+
+from src.utils import predict_batch
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "input_path", help="CSV or Parquet file with the model features"
+    )
+    parser.add_argument("output_path", help="Parquet file to write the predictions to")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100_000,
+        help="number of vehicles scored at once",
+    )
+    args = parser.parse_args()
+
+    predict_batch(args.input_path, args.output_path, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,16 +1,32 @@
+"""Build the partitioned car dataset and the dashboard cube from the raw CSV files.
+
+Every CSV file of `data/raw` is cleaned and written to a Hive-partitioned parquet
+dataset with one partition per release year. A manifest keeps the hash of each raw
+file, so later runs only rebuild the years covered by new or modified files.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
 from pathlib import Path
 
 import polars as pl
 
-# Data taken from https://open.canada.ca/data/en/dataset/98f1a129-f628-4ce4-b24d-6f16bf24dd64
+logger = logging.getLogger(__name__)
 
-file1 = Path("./data/raw/1995-2014-car-data.csv")
-file2 = Path("./data/raw/2015-2024-car-data.csv")
+# Data taken from https://open.canada.ca/data/en/dataset/98f1a129-f628-4ce4-b24d-6f16bf24dd64
 
-df1 = pl.read_csv(file1)
-df2 = pl.read_csv(file2)
+raw_folder = Path("./data/raw")
+dataset_folder = Path("./data/car_data")
+manifest_path = dataset_folder / "_manifest.json"
+cube_path = Path("./data/car_cube.parquet")
 
-df = pl.concat([df1, df2], how="vertical")
+# Partitions are sorted by make so that the min/max statistics of these row groups let
+# out-of-core queries skip the makes they do not need
+row_group_size = 16_384
 
 columns_name = {
     "Model year": "release_year",
@@ -27,8 +43,6 @@ columns_name = {
     "CO2 emissions (g/km)": "emissions",
 }
 
-df = df.select(list(columns_name.keys())).rename(columns_name)
-
 fuel_mapping = {
     "X": "Regular gasoline",
     "Z": "Premium gasoline",
@@ -37,8 +51,6 @@ fuel_mapping = {
     "N": "Natural Gas",
 }
 
-df = df.with_columns(pl.col("fuel_type").replace(fuel_mapping))
-
 vehicle_class_category = {
     "Minivan": ["MINIVAN", "Minivan"],
     "Van": ["VAN - CARGO", "VAN - PASSENGER", "Van: Passenger", "Van: Cargo"],
@@ -80,8 +92,6 @@ vehicle_class_mapping = {
     v: k for k, values in vehicle_class_category.items() for v in values
 }
 
-df = df.with_columns(pl.col("vehicle_class").replace(vehicle_class_mapping))
-
 transmission_mapping = {
     "A": "Automatic",
     "AM": "Automated manual",
@@ -90,30 +100,246 @@ transmission_mapping = {
     "M": "Manual",
 }
 
-df = df.with_columns(
-    pl.col("transmission_info").str.extract(r"(\d+)").cast(pl.Int32).alias("gears"),
-    pl.col("transmission_info")
-    .str.extract(r"([A-Z]+)")
-    .replace(transmission_mapping)
-    .alias("transmission_type"),
-).drop("transmission_info")
-
-df = df.select(
-    [
-        "release_year",
-        "make",
-        "model",
-        "vehicle_class",
-        "fuel_type",
-        "engine_size",
-        "cylinders",
-        "transmission_type",
-        "gears",
-        "fc_city",
-        "fc_highway",
-        "fc_mixed",
-        "emissions",
+output_columns = [
+    "release_year",
+    "make",
+    "model",
+    "vehicle_class",
+    "fuel_type",
+    "engine_size",
+    "cylinders",
+    "transmission_type",
+    "gears",
+    "fc_city",
+    "fc_highway",
+    "fc_mixed",
+    "emissions",
+]
+
+# String columns stored as Enums with sorted categories by the loaders, so that filters
+# and group-bys work on integer codes and the category order matches the string order.
+# Partitions keep plain strings and the categories live in the manifest, which lets a
+# new year add categories without rewriting the other partitions.
+categorical_columns = [
+    "make",
+    "model",
+    "vehicle_class",
+    "fuel_type",
+    "transmission_type",
+]
+
+# Pre-aggregated cube used by the dashboard so that its charts only slice a few
+# hundred rows instead of grouping the full dataset on every rerun
+cube_dimensions = ["release_year", "vehicle_class", "fuel_type"]
+cube_measures = ["fc_city", "fc_highway", "fc_mixed", "emissions"]
+# Means are rebuilt from sums, divided by the non-null count of each measure
+cube_columns = [
+    *cube_dimensions,
+    "model_count",
+    *(f"{m}_{stat}" for stat in ("count", "sum", "mean") for m in cube_measures),
+]
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(df: pl.DataFrame) -> str:
+    """Hash the rows of `df`, whatever their order or the Polars version.
+
+    Rows are sorted on every column and written as an Arrow IPC stream in the oldest
+    compatibility level, a stable serialization unlike `DataFrame.hash_rows`.
+    """
+    buffer = io.BytesIO()
+    df.sort(pl.all()).rechunk().write_ipc_stream(
+        buffer, compression="uncompressed", compat_level=pl.CompatLevel.oldest()
+    )
+    return hashlib.sha256(buffer.getvalue()).hexdigest()
+
+
+def transform(raw: pl.LazyFrame) -> pl.LazyFrame:
+    """Rename and clean the columns of a raw CSV file."""
+    return (
+        raw.select(list(columns_name.keys()))
+        .rename(columns_name)
+        .with_columns(
+            pl.col("fuel_type").replace(fuel_mapping),
+            pl.col("vehicle_class").replace(vehicle_class_mapping),
+            pl.col("transmission_info")
+            .str.extract(r"(\d+)")
+            .cast(pl.Int32)
+            .alias("gears"),
+            pl.col("transmission_info")
+            .str.extract(r"([A-Z]+)")
+            .replace(transmission_mapping)
+            .alias("transmission_type"),
+        )
+        .select(output_columns)
+    )
+
+
+def write_partition(df: pl.DataFrame, year: int) -> None:
+    """Replace the partition of `year` with the rows of `df`."""
+    partition = dataset_folder / f"release_year={year}"
+    partition.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = partition / "0.parquet.tmp"
+    df.drop("release_year").sort(["make", "model", "vehicle_class"]).write_parquet(
+        tmp_path, row_group_size=row_group_size
+    )
+    os.replace(tmp_path, partition / "0.parquet")
+
+
+def aggregate_cube(df: pl.DataFrame) -> pl.DataFrame:
+    return df.group_by(cube_dimensions).agg(
+        pl.len().alias("model_count"),
+        *[pl.col(m).count().alias(f"{m}_count") for m in cube_measures],
+        *[pl.col(m).sum().alias(f"{m}_sum") for m in cube_measures],
+        *[pl.col(m).mean().alias(f"{m}_mean") for m in cube_measures],
+    )
+
+
+def update_cube(df: pl.DataFrame, years: set[int], categories: dict) -> None:
+    """Replace the cube rows of `years` with the aggregates of `df`."""
+    cube = aggregate_cube(df)
+
+    if cube_path.exists():
+        previous = pl.read_parquet(cube_path).filter(
+            ~pl.col("release_year").is_in(years)
+        )
+        # Empty when the cube is outdated, `main` then replaces every year
+        if not previous.is_empty():
+            previous = previous.select(cube.columns).with_columns(
+                pl.col(cube_dimensions[1:]).cast(pl.String)
+            )
+            cube = pl.concat([previous, cube])
+
+    # Replaced at once, the running app may read the cube at any time
+    tmp_path = cube_path.with_suffix(".parquet.tmp")
+    cube.with_columns(
+        pl.col(column).cast(pl.Enum(categories[column]))
+        for column in cube_dimensions[1:]
+    ).sort(cube_dimensions).write_parquet(tmp_path)
+    os.replace(tmp_path, cube_path)
+
+
+def main() -> None:
+    raw_files = sorted(raw_folder.glob("*.csv"))
+    if not raw_files:
+        raise FileNotFoundError(f"No raw CSV files found in {raw_folder}")
+
+    manifest = (
+        json.loads(manifest_path.read_text())
+        if manifest_path.exists()
+        else {"files": {}, "categories": {}}
+    )
+    hashes = {path.name: file_hash(path) for path in raw_files}
+
+    changed_files = {
+        path.name: transform(pl.scan_csv(path)).collect()
+        for path in raw_files
+        if manifest["files"].get(path.name, {}).get("sha256") != hashes[path.name]
+    }
+    removed_files = set(manifest["files"]) - set(hashes)
+
+    # A cube missing columns of `aggregate_cube` is rebuilt from every year
+    cube_outdated = not cube_path.exists() or not set(cube_columns) <= set(
+        pl.read_parquet_schema(cube_path)
+    )
+
+    if not changed_files and not removed_files and not cube_outdated:
+        logger.info("Car dataset is up to date")
+        return
+
+    file_years = {
+        name: entry["years"]
+        for name, entry in manifest["files"].items()
+        if name in hashes
+    }
+    file_years |= {
+        name: df.get_column("release_year").unique().sort().to_list()
+        for name, df in changed_files.items()
+    }
+
+    # Years whose rows may have changed, including years a file no longer covers
+    years = {year for name in changed_files for year in file_years[name]}
+    years |= {
+        year
+        for name in changed_files.keys() | removed_files
+        for year in manifest["files"].get(name, {}).get("years", [])
+    }
+    if cube_outdated:
+        years |= {year for covered in file_years.values() for year in covered}
+
+    # Unchanged files only need to be read for the years shared with changed ones
+    unchanged_frames = [
+        transform(pl.scan_csv(raw_folder / name))
+        .filter(pl.col("release_year").is_in(years))
+        .collect()
+        for name in hashes
+        if name not in changed_files and set(file_years[name]) & years
     ]
-).sort(["release_year", "make", "model", "vehicle_class"])
+    frames = [*changed_files.values(), *unchanged_frames]
+    if not frames:
+        # Only removed files whose years no other file covers, every partition goes
+        frames = [
+            pl.DataFrame(schema=transform(pl.scan_csv(raw_files[0])).collect_schema())
+        ]
+    df = pl.concat(frames).filter(pl.col("release_year").is_in(years))
+
+    # Only rewrite the partitions whose content actually changed
+    partition_hashes = manifest.get("partitions", {})
+    written_years = 0
+
+    for year in sorted(years):
+        year_df = df.filter(pl.col("release_year") == year)
+        if year_df.is_empty():
+            shutil.rmtree(dataset_folder / f"release_year={year}", ignore_errors=True)
+            partition_hashes.pop(str(year), None)
+            continue
+
+        year_hash = content_hash(year_df)
+        if partition_hashes.get(str(year)) != year_hash:
+            write_partition(year_df, year)
+            partition_hashes[str(year)] = year_hash
+            written_years += 1
+
+    # Categories are only ever added and kept sorted, so a new value can shift the codes
+    # of existing ones. No code is stored: partitions hold strings and the cube is
+    # re-encoded on every run
+    categories = {
+        column: sorted(
+            set(manifest["categories"].get(column, []))
+            | set(df.get_column(column).drop_nulls().unique().to_list())
+        )
+        for column in categorical_columns
+    }
+
+    update_cube(df, years, categories)
+
+    manifest = {
+        "files": {
+            name: {"sha256": hashes[name], "years": file_years[name]} for name in hashes
+        },
+        "partitions": partition_hashes,
+        "categories": categories,
+    }
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, manifest_path)
+
+    logger.info(
+        "Processed %d changed raw files, %d of %d affected release years were rewritten",
+        len(changed_files),
+        written_years,
+        len(years),
+    )
+
 
-df.write_parquet(Path("./data/car_data.parquet"))
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
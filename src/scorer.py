@@ -0,0 +1,312 @@
+import hashlib
+import io
+import json
+import os
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import polars as pl
+
+# Version of the artifact written by `LinearScorer.save`
+ARTIFACT_VERSION = 1
+
+
+class LinearScorer:
+    """Lookup-table version of the trained Lasso pipeline.
+
+    The one-hot encoder is flattened into one coefficient vector per category and the
+    imputer/scaler constants of the numerical features are folded into a slope per
+    feature and a single intercept, so predictions only need dictionary lookups and a
+    few multiplications. Unknown categories contribute nothing, like the encoder's
+    `handle_unknown="ignore"`, and missing numerical values fall back to the imputer mean.
+    """
+
+    def __init__(
+        self,
+        targets: list[str],
+        intercept: list[float],
+        categorical: dict[str, dict[str, list[float]]],
+        numerical: dict[str, dict[str, Any]],
+    ) -> None:
+        self.targets = targets
+        self.intercept = intercept
+        self.categorical = categorical
+        self.numerical = numerical
+
+    @classmethod
+    def from_arrays(
+        cls,
+        targets: list[str],
+        coef: np.ndarray,
+        intercept: np.ndarray,
+        categories: dict[str, list[str]],
+        statistics: dict[str, dict[str, float]],
+    ) -> "LinearScorer":
+        """Flatten the coefficients of a Lasso fitted on encoded features.
+
+        The columns of `coef` are the one-hot `categories` of each categorical feature,
+        then the numerical features of `statistics`, imputed with their `fill` value and
+        standardized with their `mean` and `scale`.
+        """
+        coef = np.asarray(coef).reshape(len(targets), -1)
+        column_count = sum(map(len, categories.values())) + len(statistics)
+        if column_count != coef.shape[1]:
+            raise ValueError(
+                f"The feature layout has {column_count} columns but the coefficients "
+                f"have {coef.shape[1]}"
+            )
+
+        intercept = [float(v) for v in np.asarray(intercept).reshape(-1)]
+
+        categorical: dict[str, dict[str, list[float]]] = {}
+        offset = 0
+        for column, column_categories in categories.items():
+            categorical[column] = {
+                str(category): [float(v) for v in coef[:, offset + i]]
+                for i, category in enumerate(column_categories)
+            }
+            offset += len(column_categories)
+
+        numerical: dict[str, dict[str, Any]] = {}
+        for i, (column, stats) in enumerate(statistics.items(), start=offset):
+            slope = coef[:, i] / stats["scale"]
+            intercept = [
+                b - s * stats["mean"] for b, s in zip(intercept, slope, strict=True)
+            ]
+            numerical[column] = {"slope": [float(v) for v in slope], **stats}
+
+        return cls(targets, intercept, categorical, numerical)
+
+    @classmethod
+    def from_pipeline(cls, pipeline: Any, targets: list[str]) -> "LinearScorer":
+        """Flatten a fitted `ColumnTransformer` + `Lasso` pipeline into lookup tables."""
+        preprocessor = pipeline.named_steps["preprocessor"]
+        regressor = pipeline.named_steps["regressor"]
+        coef = regressor.coef_.reshape(len(targets), -1)
+
+        categories: dict[str, list[str]] = {}
+        statistics: dict[str, dict[str, float]] = {}
+
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == "drop" or not len(columns):
+                continue
+
+            if name == "categorical":
+                if transformer.drop is not None:
+                    raise ValueError(
+                        "Only one-hot encoders without dropped categories can be flattened"
+                    )
+
+                for column, column_categories in zip(
+                    columns, transformer.categories_, strict=True
+                ):
+                    categories[column] = [str(c) for c in column_categories]
+            elif name == "numerical":
+                imputer = transformer.named_steps["imputer"]
+                scaler = transformer.named_steps["scaler"]
+
+                for i, column in enumerate(columns):
+                    statistics[column] = {
+                        "fill": float(imputer.statistics_[i]),
+                        "mean": float(scaler.mean_[i]),
+                        "scale": float(scaler.scale_[i]),
+                    }
+            else:
+                raise ValueError(f"Unexpected transformer {name!r} in the preprocessor")
+
+        # Put the categorical columns first, as expected by `from_arrays`
+        coef = np.hstack(
+            [
+                coef[:, preprocessor.output_indices_.get(name, slice(0))]
+                for name in ("categorical", "numerical")
+            ]
+        )
+
+        return cls.from_arrays(
+            targets, coef, regressor.intercept_, categories, statistics
+        )
+
+    @classmethod
+    def load(cls, manifest_path: str | Path) -> "LinearScorer":
+        """Load a model artifact written by `save`, without scikit-learn."""
+        manifest_path = Path(manifest_path)
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("version") != ARTIFACT_VERSION:
+            raise ValueError(
+                f"Unsupported model artifact version {manifest.get('version')!r} in "
+                f"{manifest_path}, expected {ARTIFACT_VERSION}"
+            )
+
+        content = (manifest_path.parent / manifest["arrays"]).read_bytes()
+        if "arrays_sha256" in manifest and (
+            hashlib.sha256(content).hexdigest() != manifest["arrays_sha256"]
+        ):
+            raise ValueError(
+                f"The arrays of {manifest_path} do not match its manifest, the model "
+                "is being exported or the artifact is corrupted"
+            )
+
+        with np.load(io.BytesIO(content)) as arrays:
+            return cls.from_arrays(
+                manifest["targets"],
+                arrays["coef"],
+                arrays["intercept"],
+                manifest["categorical"],
+                manifest["numerical"],
+            )
+
+    def save(self, manifest_path: str | Path, data_hash: str) -> None:
+        """Write the model as a JSON manifest next to its `.npz` coefficient arrays.
+
+        The manifest holds the feature layout, the categories, the imputer and scaler
+        statistics, the target names, the hash of the training data and the hash of
+        the arrays, checked by `load`. The arrays hold the coefficients of the encoded
+        features and the intercepts.
+        """
+        manifest_path = Path(manifest_path)
+        arrays_path = manifest_path.with_suffix(".npz")
+
+        slopes = np.array(
+            [params["slope"] for params in self.numerical.values()]
+        ).reshape(-1, len(self.targets))
+        scales = np.array([params["scale"] for params in self.numerical.values()])
+        means = np.array([params["mean"] for params in self.numerical.values()])
+        coef = np.hstack(
+            [
+                np.array(
+                    [
+                        coefs
+                        for table in self.categorical.values()
+                        for coefs in table.values()
+                    ]
+                )
+                .reshape(-1, len(self.targets))
+                .T,
+                (slopes * scales[:, None]).T,
+            ]
+        )
+        intercept = np.array(self.intercept) + slopes.T @ means
+
+        # The running app reloads the model when its files are replaced: the arrays are
+        # replaced first, then the manifest with their hash
+        buffer = io.BytesIO()
+        np.savez(buffer, coef=coef, intercept=intercept)
+        tmp_path = arrays_path.with_suffix(".npz.tmp")
+        tmp_path.write_bytes(buffer.getvalue())
+        os.replace(tmp_path, arrays_path)
+
+        manifest = {
+            "version": ARTIFACT_VERSION,
+            "arrays": arrays_path.name,
+            "arrays_sha256": hashlib.sha256(buffer.getvalue()).hexdigest(),
+            "targets": self.targets,
+            "categorical": {
+                feature: list(table) for feature, table in self.categorical.items()
+            },
+            "numerical": {
+                feature: {key: params[key] for key in ("fill", "mean", "scale")}
+                for feature, params in self.numerical.items()
+            },
+            "data_hash": data_hash,
+        }
+        tmp_path = manifest_path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, manifest_path)
+
+    @property
+    def features(self) -> list[str]:
+        return [*self.categorical, *self.numerical]
+
+    def predict_one(self, features: Mapping[str, Any]) -> list[float]:
+        """Predict every target for a single vehicle given as a feature mapping."""
+        result = list(self.intercept)
+
+        for feature, table in self.categorical.items():
+            coefs = table.get(features.get(feature))
+            if coefs is not None:
+                result = [r + c for r, c in zip(result, coefs, strict=True)]
+
+        for feature, params in self.numerical.items():
+            value = features.get(feature)
+            if value is None:
+                value = params["fill"]
+            result = [
+                r + value * s for r, s in zip(result, params["slope"], strict=True)
+            ]
+
+        return result
+
+    def expressions(self) -> list[pl.Expr]:
+        """Polars expressions computing every target, one column per target."""
+        exprs = []
+
+        for t, target in enumerate(self.targets):
+            expr = pl.lit(self.intercept[t], dtype=pl.Float64)
+
+            for feature, table in self.categorical.items():
+                expr += (
+                    pl.col(feature)
+                    .cast(pl.String)
+                    .replace_strict(
+                        list(table),
+                        [coefs[t] for coefs in table.values()],
+                        default=0.0,
+                        return_dtype=pl.Float64,
+                    )
+                )
+
+            for feature, params in self.numerical.items():
+                expr += (
+                    pl.col(feature).cast(pl.Float64).fill_null(params["fill"])
+                    * params["slope"][t]
+                )
+
+            exprs.append(expr.alias(target))
+
+        return exprs
+
+    def encoding_expressions(self) -> list[pl.Expr]:
+        """Polars expressions of the features as seen by the Lasso, one column each.
+
+        Categories are one-hot encoded and numerical features imputed and standardized,
+        like the pipeline's `ColumnTransformer`.
+        """
+        exprs = [
+            (pl.col(feature).cast(pl.String) == category)
+            .fill_null(value=False)
+            .cast(pl.Float64)
+            .alias(f"{feature}_{category}")
+            for feature, table in self.categorical.items()
+            for category in table
+        ]
+        exprs += [
+            (
+                (
+                    pl.col(feature).cast(pl.Float64).fill_null(params["fill"])
+                    - params["mean"]
+                )
+                / params["scale"]
+            ).alias(feature)
+            for feature, params in self.numerical.items()
+        ]
+        return exprs
+
+    def encode_one(self, features: Mapping[str, Any]) -> list[float]:
+        """Encode a single vehicle like `encoding_expressions` encodes a dataframe."""
+        encoded = [
+            1.0 if features.get(feature) == category else 0.0
+            for feature, table in self.categorical.items()
+            for category in table
+        ]
+        for feature, params in self.numerical.items():
+            value = features.get(feature)
+            if value is None:
+                value = params["fill"]
+            encoded.append((value - params["mean"]) / params["scale"])
+        return encoded
+
+    def predict_frame(self, df: pl.DataFrame) -> pl.DataFrame:
+        """Predict every target for each row of a dataframe holding the model features."""
+        return df.select(self.expressions())
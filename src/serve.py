@@ -0,0 +1,332 @@
+"""Local JSON service for vehicle queries and consumption predictions.
+
+Run from the repository root with `python -m src.serve`, then:
+
+- `POST /vehicles` with `{"make": ..., "model": ..., "filters": [...], "limit": 100}`
+  returns the matching vehicles. `filters` holds `[column, condition]` pairs with the
+  conditions of the vehicle finder's filters: `["is_in", [values]]`,
+  `["is_between", low, high]`, `["is_not_null"]` or `["contains", pattern, literal]`;
+- `POST /predict` with a vehicle, or a list of vehicles, given as model features
+  returns one prediction per vehicle;
+- `GET /health` returns the data version and the batching statistics.
+
+Predictions of concurrent requests are coalesced: the first request of a batch waits
+up to `--max-wait-ms` for others, then the whole batch is scored with a single
+vectorized call. Like the app, the service follows updates of the data files: requests
+use the latest version swapped in by the data watcher.
+"""
+
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import polars as pl
+
+from src.utils import (
+    DATA_PATH,
+    DataVersion,
+    DataWatcher,
+    combined_filter,
+    display_columns_name_mapping,
+    filter_spec,
+    get_query_cache,
+    load_model,
+    query_car_data,
+    start_data_watcher,
+)
+
+logger = logging.getLogger(__name__)
+
+condition_kinds = {"is_in": 1, "is_between": 2, "is_not_null": 0, "contains": 2}
+
+max_limit = 10_000
+
+
+class PredictionBatcher:
+    """Coalesce the prediction requests of concurrent threads into single batches."""
+
+    def __init__(
+        self, watcher: DataWatcher, max_batch_size: int, max_wait_ms: float
+    ) -> None:
+        self.watcher = watcher
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.model = self._prepare(watcher.current)
+        self.requests: queue.Queue[tuple[pl.DataFrame, Future]] = queue.Queue()
+        self.batch_count = 0
+        self.request_count = 0
+        self.vehicle_count = 0
+        threading.Thread(
+            target=self._run, name="prediction-batcher", daemon=True
+        ).start()
+
+    @staticmethod
+    def _prepare(
+        version: DataVersion,
+    ) -> tuple[DataVersion, dict[str, type[pl.DataType]], list[pl.Expr]]:
+        scorer = load_model(version)
+        schema = {
+            feature: pl.String if feature in scorer.categorical else pl.Float64
+            for feature in scorer.features
+        }
+        # Built once per model instead of for every batch, as `predict_frame` does
+        return version, schema, scorer.expressions()
+
+    def _current_model(
+        self,
+    ) -> tuple[DataVersion, dict[str, type[pl.DataType]], list[pl.Expr]]:
+        if self.model[0] != self.watcher.current:
+            self.model = self._prepare(self.watcher.current)
+        return self.model
+
+    def features_frame(self, vehicles: list[dict[str, Any]]) -> pl.DataFrame:
+        """Validate vehicles given as feature mappings and put them in a frame."""
+        if not all(isinstance(vehicle, dict) for vehicle in vehicles):
+            raise ValueError("Vehicles must be JSON objects of model features")
+        try:
+            return pl.DataFrame(vehicles, schema=self._current_model()[1], strict=False)
+        except (TypeError, pl.exceptions.PolarsError) as e:
+            raise ValueError(f"Invalid vehicle features: {e}") from e
+
+    def predict(self, vehicles: list[dict[str, Any]]) -> list[dict[str, float]]:
+        """Predict every target of `vehicles`, as part of the next batch."""
+        future: Future = Future()
+        self.requests.put((self.features_frame(vehicles), future))
+        return future.result()
+
+    def _next_batch(self) -> list[tuple[pl.DataFrame, Future]]:
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            frames, futures = zip(*batch, strict=True)
+
+            try:
+                # One chunk per request would make Polars evaluate them one by one
+                features = pl.concat(frames, rechunk=True)
+                expressions = self._current_model()[2]
+                predictions = features.select(expressions).to_dicts()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            self.batch_count += 1
+            self.request_count += len(batch)
+            self.vehicle_count += len(predictions)
+
+            offset = 0
+            for frame, future in batch:
+                future.set_result(predictions[offset : offset + len(frame)])
+                offset += len(frame)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "batches": self.batch_count,
+            "requests": self.request_count,
+            "vehicles": self.vehicle_count,
+            "mean_batch_requests": self.request_count / max(self.batch_count, 1),
+        }
+
+
+def _valid_arguments(kind: str, args: list[Any]) -> bool:
+    if kind == "is_in":
+        return isinstance(args[0], list) and all(
+            isinstance(value, str | int | float) for value in args[0]
+        )
+    if kind == "is_between":
+        # Strings would be read as column names
+        return all(
+            isinstance(value, int | float) and not isinstance(value, bool)
+            for value in args
+        )
+    if kind == "contains":
+        return isinstance(args[0], str) and isinstance(args[1], bool)
+    return True
+
+
+def parse_conditions(filters: Any) -> list[tuple[str, tuple]]:
+    """Validate `[column, condition]` pairs and return them as explorer conditions."""
+    if not isinstance(filters, list):
+        raise ValueError("filters must be a list of [column, condition] pairs")
+
+    conditions = []
+    for item in filters:
+        if not (isinstance(item, list) and len(item) == 2):
+            raise ValueError(f"Invalid filter {item!r}, expected [column, condition]")
+
+        column, condition = item
+        if column not in display_columns_name_mapping:
+            raise ValueError(f"Unknown column {column!r}")
+        if not isinstance(condition, list) or not condition:
+            raise ValueError(f"Invalid condition {condition!r} on {column!r}")
+
+        kind, *args = condition
+        if condition_kinds.get(kind) != len(args) or not _valid_arguments(kind, args):
+            raise ValueError(f"Invalid condition {condition!r} on {column!r}")
+        if kind == "is_in":
+            args = [tuple(args[0])]
+
+        conditions.append((column, (kind, *args)))
+
+    return conditions
+
+
+def query_vehicles(request: dict[str, Any], version: DataVersion) -> dict[str, Any]:
+    """Vehicles of `version` matching the make, model and filters of a request."""
+    make, model = request.get("make"), request.get("model")
+    limit = request.get("limit", 100)
+    if not isinstance(limit, int) or not 0 < limit <= max_limit:
+        raise ValueError(f"limit must be an integer between 1 and {max_limit}")
+
+    conditions = parse_conditions(request.get("filters", []))
+    lf = query_car_data(version, make=make, model=model)
+    schema = lf.collect_schema()
+
+    # Values outside of a dictionary cannot match, and cannot be cast to it either
+    for i, (column, condition) in enumerate(conditions):
+        if condition[0] == "is_in" and isinstance(schema[column], pl.Enum):
+            categories = set(schema[column].categories)
+            values = tuple(value for value in condition[1] if value in categories)
+            conditions[i] = (column, ("is_in", values))
+
+    spec = filter_spec(conditions)
+    cache = get_query_cache()
+    key = ("serve", version, make, model, spec, limit)
+    result = cache.get(key)
+
+    if result is None:
+        # One extra row tells whether the result was truncated
+        df = lf.filter(combined_filter(list(spec))).head(limit + 1).collect()
+        result = {
+            "vehicles": df.head(limit).to_dicts(),
+            "truncated": len(df) > limit,
+        }
+        cache.put(key, result)
+
+    return result
+
+
+class Server(ThreadingHTTPServer):
+    # Queue the connections of many concurrent clients instead of resetting them
+    request_queue_size = 128
+
+
+def make_handler(batcher: PredictionBatcher, watcher: DataWatcher) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections alive between the requests of a client, and send responses
+        # without waiting for the acknowledgement of their headers
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self) -> None:
+            if self.path != "/health":
+                self._send(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+                return
+            self._send(
+                HTTPStatus.OK,
+                {
+                    "data_version": watcher.current.fingerprint,
+                    "batching": batcher.stats(),
+                    "query_cache": get_query_cache().stats(),
+                },
+            )
+
+        def do_POST(self) -> None:
+            try:
+                request = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                if self.path == "/vehicles":
+                    if not isinstance(request, dict):
+                        raise ValueError("The query must be a JSON object")
+                    response = query_vehicles(request, watcher.current)
+                elif self.path == "/predict":
+                    vehicles = request if isinstance(request, list) else [request]
+                    response = {"predictions": batcher.predict(vehicles)}
+                else:
+                    self._send(
+                        HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"}
+                    )
+                    return
+            except (TypeError, ValueError, pl.exceptions.PolarsError) as e:
+                self._send(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                return
+
+            self._send(HTTPStatus.OK, response)
+
+        def _send(self, status: HTTPStatus, body: dict[str, Any]) -> None:
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+            logger.debug(format, *args)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=1_024,
+        help="number of vehicles scored at once, 1 disables batching",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=2.0,
+        help="time the first request of a batch waits for others",
+    )
+    args = parser.parse_args()
+
+    # Load the data and the model before accepting requests
+    watcher = start_data_watcher(DATA_PATH)
+    query_car_data(watcher.current).head(1).collect()
+    batcher = PredictionBatcher(watcher, args.max_batch_size, args.max_wait_ms)
+
+    server = Server((args.host, args.port), make_handler(batcher, watcher))
+    logger.info("Serving on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
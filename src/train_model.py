@@ -0,0 +1,198 @@
+"""Train the Lasso pipeline used by the app and export it.
+
+Run from the repository root with `python -m src.train_model`. This replaces the grid
+search of `src/model_training.ipynb`:
+
+- the features are one-hot encoded, imputed and scaled once, and every fold reuses
+  that design matrix instead of transforming its own copy;
+- each target's regularization path is fitted from the largest alpha down with warm
+  starts, so each alpha starts from the previous solution;
+- the (fold, target) paths run in a process pool.
+
+The alpha with the best R² averaged over folds and targets, as scored by the grid
+search, is refitted on the whole dataset. The pipeline is pickled and flattened for
+`LinearScorer` by `src/export_model.py`.
+"""
+
+import argparse
+import logging
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import Lasso
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from src import export_model
+from src.utils import scan_car_data
+
+logger = logging.getLogger(__name__)
+
+model_path = Path("./data/lasso_regression.pkl")
+
+numerical_features = ["release_year", "gears", "engine_size", "cylinders"]
+categorical_features = ["make", "vehicle_class", "fuel_type", "transmission_type"]
+features = numerical_features + categorical_features
+
+targets = ["emissions", "fc_mixed", "fc_city", "fc_highway"]
+
+max_iter = 10_000
+
+# Design matrix and targets shared with the worker processes
+_design = None
+_targets = None
+
+
+def build_pipeline(alpha: float = 1.0) -> Pipeline:
+    """The preprocessing and Lasso pipeline served by the app."""
+    preprocessor = ColumnTransformer(
+        transformers=[
+            (
+                "categorical",
+                OneHotEncoder(handle_unknown="ignore"),
+                categorical_features,
+            ),
+            (
+                "numerical",
+                Pipeline(
+                    steps=[
+                        ("imputer", SimpleImputer(strategy="mean")),
+                        ("scaler", StandardScaler()),
+                    ]
+                ),
+                numerical_features,
+            ),
+        ]
+    )
+
+    return Pipeline(
+        steps=[
+            ("preprocessor", preprocessor),
+            ("regressor", Lasso(alpha=alpha, max_iter=max_iter)),
+        ]
+    )
+
+
+def _init_worker(design, target_values: np.ndarray) -> None:
+    global _design, _targets
+    _design = design
+    _targets = target_values
+
+
+def _fit_path(
+    train: np.ndarray, test: np.ndarray, target: int, alphas: list[float]
+) -> tuple[list[float], float]:
+    """Validation R² of one target along the regularization path, and the fit time."""
+    model = Lasso(max_iter=max_iter, warm_start=True)
+    x_train, x_test = _design[train], _design[test]
+    y_train, y_test = _targets[train, target], _targets[test, target]
+
+    scores = [0.0] * len(alphas)
+    start = time.perf_counter()
+    # Decreasing alphas, so that each fit starts from a sparser solution
+    for i in sorted(range(len(alphas)), key=lambda i: alphas[i], reverse=True):
+        model.set_params(alpha=alphas[i])
+        model.fit(x_train, y_train)
+        scores[i] = r2_score(y_test, model.predict(x_test))
+
+    return scores, time.perf_counter() - start
+
+
+def cross_validate(
+    df: pl.DataFrame, alphas: list[float], folds: int, workers: int | None
+) -> np.ndarray:
+    """Cross-validated R² of every target along the path, shaped (folds, targets, alphas)."""
+    start = time.perf_counter()
+    design = build_pipeline().named_steps["preprocessor"].fit_transform(df[features])
+    target_values = df.select(targets).to_numpy()
+    logger.info(
+        "Built the %d x %d design matrix in %.2fs",
+        design.shape[0],
+        design.shape[1],
+        time.perf_counter() - start,
+    )
+
+    splits = list(KFold(n_splits=folds).split(target_values))
+    tasks = [
+        (fold, target, train, test)
+        for fold, (train, test) in enumerate(splits)
+        for target in range(len(targets))
+    ]
+    scores = np.empty((folds, len(targets), len(alphas)))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(design, target_values)
+    ) as executor:
+        futures = [
+            executor.submit(_fit_path, train, test, target, alphas)
+            for _, target, train, test in tasks
+        ]
+        for (fold, target, _, _), future in zip(tasks, futures, strict=True):
+            scores[fold, target], elapsed = future.result()
+            logger.info(
+                "Fold %d, %s: path of %d alphas fitted in %.2fs",
+                fold,
+                targets[target],
+                len(alphas),
+                elapsed,
+            )
+
+    logger.info(
+        "Cross-validated %d paths in %.2fs", len(tasks), time.perf_counter() - start
+    )
+    return scores
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--alpha-min", type=float, default=1e-3)
+    parser.add_argument("--alpha-max", type=float, default=100.0)
+    parser.add_argument("--n-alphas", type=int, default=26)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, help="defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    alphas = np.geomspace(args.alpha_min, args.alpha_max, args.n_alphas).tolist()
+    df = scan_car_data(dictionary_encoded=False).collect()
+
+    scores = cross_validate(df, alphas, args.folds, args.workers)
+
+    for target, target_scores in zip(targets, scores.mean(axis=0), strict=True):
+        best = int(target_scores.argmax())
+        logger.info(
+            "%s: best alpha %.4g with a mean R² of %.4f",
+            target,
+            alphas[best],
+            target_scores[best],
+        )
+
+    mean_scores = scores.mean(axis=(0, 1))
+    for alpha, score in zip(alphas, mean_scores, strict=True):
+        logger.info("alpha %10.4g: mean R² %.4f", alpha, score)
+
+    best_alpha = alphas[int(mean_scores.argmax())]
+    logger.info("Best alpha: %.4g (mean R² %.4f)", best_alpha, float(mean_scores.max()))
+
+    start = time.perf_counter()
+    pipeline = build_pipeline(best_alpha).fit(df[features], df[targets])
+    logger.info("Refitted the pipeline in %.2fs", time.perf_counter() - start)
+
+    with model_path.open("wb") as f:
+        pickle.dump(pipeline, f)
+    logger.info("Saved %s", model_path)
+
+    export_model.main()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
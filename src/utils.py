@@ -1,16 +1,56 @@
+import functools
 import hashlib
-import pickle
+import importlib
+import itertools
+import json
+import logging
+import os
 import re
-from datetime import datetime, time
+import sys
+import tempfile
+import threading
+import time as timer
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass
+from datetime import UTC, datetime, time
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 import polars as pl
 import streamlit as st
-from sklearn.pipeline import Pipeline
+
+from src.scorer import LinearScorer
+
+logger = logging.getLogger(__name__)
 
 DATA_PATH = Path("data/")
 
+# "memory" shares one memory-mapped copy of the dataset between sessions, "lazy" runs
+# every page query out-of-core against the partitioned parquet dataset
+DATA_BACKEND = os.environ.get("FUEL_APP_DATA_BACKEND", "memory")
+if DATA_BACKEND not in ("memory", "lazy"):
+    raise ValueError(
+        f"Unknown data backend {DATA_BACKEND!r}, expected 'memory' or 'lazy'"
+    )
+
+if DATA_BACKEND == "lazy":
+    # Process out-of-core queries in bounded memory batches
+    pl.Config.set_engine_affinity("streaming")
+
+# Set FUEL_APP_PROFILE=1, or open a page with ?profile=1, to time every rerun
+PROFILE_ENABLED = os.environ.get("FUEL_APP_PROFILE", "0") != "0"
+PROFILE_LOG_PATH = Path(os.environ.get("FUEL_APP_PROFILE_LOG", "logs/timings.jsonl"))
+
+# Memory cap of the query results shared by every session
+QUERY_CACHE_MB = float(os.environ.get("FUEL_APP_QUERY_CACHE_MB", "256"))
+
+# Seconds between two checks of the data files for updates, 0 disables hot reloads
+WATCH_INTERVAL = float(os.environ.get("FUEL_APP_WATCH_INTERVAL", "2"))
+
 # Mapping of columns name to display name
 display_columns_name_mapping = {
     "release_year": "Release year",
@@ -28,20 +68,1523 @@ display_columns_name_mapping = {
     "emissions": "CO2 emissions (g/km)",
 }
 
+# Columns of a fleet file, and the key identifying its vehicles in the car data
+fleet_columns = {
+    "release_year": pl.Int64,
+    "make": pl.String,
+    "model": pl.String,
+    "annual_km": pl.Float64,
+    "fuel_price": pl.Float64,
+}
+fleet_keys = ["release_year", "make", "model"]
 
-@st.cache_data
-def load_car_data(folder_path: str | Path = DATA_PATH) -> pl.DataFrame:
-    """Load the processed car data from a parquet file."""
-    return pl.read_parquet(Path(folder_path) / "car_data.parquet")
+# Measures aggregated in the car cube written by process_data.py
+cube_measures = ["fc_city", "fc_highway", "fc_mixed", "emissions"]
+
+# Files of the model artifact written by `src/export_model.py`
+model_files = ["lasso_regression.json", "lasso_regression.npz"]
+
+
+def scan_car_data(
+    folder_path: str | Path = DATA_PATH, dictionary_encoded: bool = True
+) -> pl.LazyFrame:
+    """Lazily scan the release-year partitioned car dataset written by process_data.py.
+
+    With `dictionary_encoded`, the string columns are cast to Enums using the category
+    dictionaries of the manifest. Without it they stay strings, which lets Polars push
+    filters on them down to the row-group statistics of the parquet files.
+    """
+    dataset_path = Path(folder_path) / "car_data"
+    lf = pl.scan_parquet(
+        dataset_path / "**/*.parquet",
+        hive_partitioning=True,
+        hive_schema={"release_year": pl.Int64},
+    )
+
+    if dictionary_encoded:
+        manifest = json.loads((dataset_path / "_manifest.json").read_text())
+        lf = lf.with_columns(
+            pl.col(column).cast(pl.Enum(categories))
+            for column, categories in manifest["categories"].items()
+        )
+
+    return lf.select(list(display_columns_name_mapping))
+
+
+def dataset_hash(folder_path: str | Path = DATA_PATH) -> str:
+    """Hash of the car dataset content, from the partition hashes of its manifest."""
+    manifest = json.loads(
+        (Path(folder_path) / "car_data" / "_manifest.json").read_text()
+    )
+    content = json.dumps(manifest["partitions"], sort_keys=True).encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+@dataclass(frozen=True)
+class DataVersion:
+    """A data folder with the fingerprint of its car data and model artifact.
+
+    Cached loaders take the version they load as their only argument, so that updated
+    files are loaded as new cache entries while sessions started on the previous files
+    keep reading those.
+    """
+
+    folder_path: Path
+    fingerprint: str
+
+    @classmethod
+    def read(cls, folder_path: str | Path = DATA_PATH) -> "DataVersion":
+        """Fingerprint the car data and the model artifact currently in `folder_path`."""
+        folder_path = Path(folder_path)
+        content = hashlib.sha256(dataset_hash(folder_path).encode())
+        for name in model_files:
+            content.update((folder_path / name).read_bytes())
+        return cls(folder_path, content.hexdigest()[:16])
+
+
+def _ensure_ipc_copy(dataset_path: Path) -> Path:
+    """Convert the partitioned dataset to an uncompressed Arrow IPC file, if outdated.
+
+    Rows are sorted by (make, model), so that the vehicles of a make or a model are a
+    slice of the memory-mapped frame. The sort is part of the file name, which rebuilds
+    the copies written before rows were sorted.
+    """
+    ipc_path = dataset_path.with_suffix(".by_make.arrow")
+    manifest_path = dataset_path / "_manifest.json"
+
+    if (
+        not ipc_path.exists()
+        or ipc_path.stat().st_mtime_ns < manifest_path.stat().st_mtime_ns
+    ):
+        # The app and the service may both convert the dataset, each in its own file
+        with tempfile.NamedTemporaryFile(
+            dir=ipc_path.parent, suffix=".arrow.tmp", delete=False
+        ) as f:
+            tmp_path = Path(f.name)
+        try:
+            scan_car_data(dataset_path.parent).sort(
+                ["make", "model"], maintain_order=True
+            ).collect().write_ipc(tmp_path, compression="uncompressed")
+            os.replace(tmp_path, ipc_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    return ipc_path
+
+
+def _is_memory_mapped(path: Path) -> bool | None:
+    """Whether `path` is mapped in this process, or None when it cannot be checked."""
+    maps_path = Path("/proc/self/maps")
+    if not maps_path.exists():
+        return None
+
+    mapped_path = str(path.resolve())
+    with maps_path.open() as f:
+        return any(line.rstrip().endswith(mapped_path) for line in f)
+
+
+@st.cache_resource
+def load_car_data(version: DataVersion) -> pl.DataFrame:
+    """Load the processed car data, shared by every session.
+
+    The partitioned dataset is converted once to an Arrow IPC file that is memory-mapped,
+    so all sessions read the same frame without copies. The returned frame is read-only:
+    derive new frames from it instead of modifying it in place.
+    """
+    with span("load_car_data.ipc_copy"):
+        ipc_path = _ensure_ipc_copy(version.folder_path / "car_data")
+    with span("load_car_data.read"):
+        df = pl.read_ipc(ipc_path, memory_map=True, rechunk=False)
+
+    memory_mapped = _is_memory_mapped(ipc_path)
+    if memory_mapped is None:
+        logger.info(
+            "Cannot check whether %s is memory-mapped on this platform", ipc_path
+        )
+    elif memory_mapped:
+        logger.info("Car data is memory-mapped from %s", ipc_path)
+    else:
+        logger.warning("Car data was copied in memory instead of mapping %s", ipc_path)
+
+    return df
+
+
+@dataclass(frozen=True)
+class OptionIndex:
+    """Dropdown options of the car data and row ranges of each make and model.
+
+    `row_ranges` maps a `(make, None)` or `(make, model)` key to an `(offset, length)`
+    slice of the car data loaded by `load_car_data`, sorted by (make, model). It is only
+    built by the memory backend.
+    """
+
+    options: dict[str, list[Any]]
+    bounds: dict[str, tuple[Any, Any]]
+    models_by_make: dict[str, list[str]]
+    row_ranges: dict[tuple[str, str | None], tuple[int, int]]
+
+
+@st.cache_resource
+def load_option_index(version: DataVersion) -> OptionIndex:
+    """Build the option index of the car data once per data version."""
+    lf = (
+        scan_car_data(version.folder_path, dictionary_encoded=False)
+        if DATA_BACKEND == "lazy"
+        else load_car_data(version).lazy()
+    )
+
+    categorical_columns = [
+        "make",
+        "model",
+        "vehicle_class",
+        "fuel_type",
+        "transmission_type",
+    ]
+    numerical_columns = ["release_year", "engine_size", "cylinders", "gears"]
+
+    stats_query = lf.select(
+        pl.col(categorical_columns).drop_nulls().unique().sort().implode(),
+        pl.col(numerical_columns).min().name.suffix("_min"),
+        pl.col(numerical_columns).max().name.suffix("_max"),
+    )
+    # Every (make, model) pair. The mapped frame of the memory backend is sorted by
+    # (make, model), so the row range of a model also starts at its first row
+    groups_query = (
+        lf.with_row_index("offset")
+        .group_by(["make", "model"])
+        .agg(pl.col("offset").first(), pl.len())
+        .sort(["make", "model"])
+        if DATA_BACKEND == "memory"
+        else lf.select("make", "model").unique().sort(["make", "model"])
+    )
+
+    stats, groups = pl.collect_all([stats_query, groups_query])
+    stats = stats.row(0, named=True)
+
+    models_by_make: dict[str, list[str]] = {}
+    for make, model in groups.select("make", "model").iter_rows():
+        models_by_make.setdefault(make, []).append(model)
+
+    row_ranges: dict[tuple[str, str | None], tuple[int, int]] = {}
+    if DATA_BACKEND == "memory":
+        for make, model, offset, length in groups.iter_rows():
+            row_ranges[(make, model)] = (offset, length)
+            make_offset, make_length = row_ranges.get((make, None), (offset, 0))
+            row_ranges[(make, None)] = (make_offset, make_length + length)
+
+    return OptionIndex(
+        options={column: stats[column] for column in categorical_columns},
+        bounds={
+            column: (stats[f"{column}_min"], stats[f"{column}_max"])
+            for column in numerical_columns
+        },
+        models_by_make=models_by_make,
+        row_ranges=row_ranges,
+    )
+
+
+def query_car_data(
+    version: DataVersion, make: str | None = None, model: str | None = None
+) -> pl.LazyFrame:
+    """Lazy frame of the car data for page queries, backed by `DATA_BACKEND`.
+
+    Pages should apply their filters and aggregations to it before collecting, so that
+    the lazy backend only reads the row groups they need. With the memory backend, a
+    selected make (and model) is a slice of the shared car data instead of a filter.
+    """
+    if DATA_BACKEND == "lazy":
+        lf = scan_car_data(version.folder_path, dictionary_encoded=False)
+    elif make is not None:
+        offset, length = load_option_index(version).row_ranges.get(
+            (make, model), (0, 0)
+        )
+        return load_car_data(version).slice(offset, length).lazy()
+    else:
+        lf = load_car_data(version).lazy()
+
+    if make is not None:
+        lf = lf.filter(pl.col("make") == make)
+    if model is not None:
+        lf = lf.filter(pl.col("model") == model)
+
+    return lf
+
+
+@dataclass(frozen=True)
+class SearchIndex:
+    """Trigram inverted index over the make and make + model names of the car data.
+
+    Names are compared without case, spaces or punctuation, so that "Mercedes Benz"
+    finds "Mercedes-Benz" and "F150" finds "F-150", and typos only lose the few
+    trigrams they touch.
+    """
+
+    entries: list[tuple[str, str | None]]
+    trigram_counts: list[int]
+    postings: dict[str, list[int]]
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"[^0-9a-z]", "", text.lower())
+
+    @staticmethod
+    def trigrams(text: str) -> set[str]:
+        padded = f"  {text} "
+        return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+    @classmethod
+    def build(cls, models_by_make: dict[str, list[str]]) -> "SearchIndex":
+        """Index every make on its own and together with each of its models."""
+        entries: list[tuple[str, str | None]] = []
+        trigram_counts = []
+        postings: dict[str, list[int]] = {}
+
+        for make, models in models_by_make.items():
+            for model in [None, *models]:
+                names = [make] if model is None else [make, model, make + model]
+                trigrams = set().union(
+                    *(cls.trigrams(cls.normalize(name)) for name in names)
+                )
+
+                for trigram in trigrams:
+                    postings.setdefault(trigram, []).append(len(entries))
+                entries.append((make, model))
+                trigram_counts.append(len(trigrams))
+
+        return cls(entries, trigram_counts, postings)
+
+    def search(
+        self, query: str, limit: int = 10, min_score: float = 0.4
+    ) -> list[tuple[str, str | None]]:
+        """Rank the `(make, model)` entries by the share of the query's trigrams they hold.
+
+        Ties are broken in favor of the entries with the fewest trigrams, so that a
+        make alone ranks before its models. `model` is None for make entries.
+        """
+        query_trigrams = self.trigrams(self.normalize(query))
+        if len(query_trigrams) < 3:
+            return []
+
+        shared: dict[int, int] = {}
+        for trigram in query_trigrams:
+            for entry in self.postings.get(trigram, ()):
+                shared[entry] = shared.get(entry, 0) + 1
+
+        min_shared = min_score * len(query_trigrams)
+        ranked = sorted(
+            (entry for entry, count in shared.items() if count >= min_shared),
+            key=lambda entry: (
+                -shared[entry],
+                self.trigram_counts[entry],
+                self.entries[entry][0],
+                self.entries[entry][1] or "",
+            ),
+        )
+        return [self.entries[entry] for entry in ranked[:limit]]
+
+
+@st.cache_resource
+def load_search_index(version: DataVersion) -> SearchIndex:
+    """Build the make and model search index once per data version."""
+    return SearchIndex.build(load_option_index(version).models_by_make)
+
+
+# Columns of the similar vehicles
+neighbor_columns = [
+    "release_year",
+    "make",
+    "model",
+    "vehicle_class",
+    "fuel_type",
+    "engine_size",
+    "cylinders",
+    "transmission_type",
+    "gears",
+    "fc_mixed",
+    "emissions",
+]
+
+
+@dataclass(frozen=True)
+class NeighborIndex:
+    """KD-tree over the distinct feature points of the car data, encoded like the features seen by the Lasso.
+
+    Vehicles with identical features share one point of the tree. With the memory
+    backend, `vehicles` is sorted by point, the rows of point `i` spanning `offsets[i]`
+    to `offsets[i + 1]`. With the lazy backend only the points are held, and the rows
+    of the closest points are read from the car data.
+    """
+
+    tree: Any
+    scorer: LinearScorer
+    version: DataVersion
+    points: pl.DataFrame
+    vehicles: pl.DataFrame | None
+    offsets: list[int]
+
+    def query(self, features: dict[str, Any], k: int = 5) -> pl.DataFrame:
+        """Return the `k` vehicles closest to `features`, with their `distance`."""
+        # Every point holds at least one vehicle, so the k closest points are enough
+        k = min(k, self.points.height)
+        distances, points = self.tree.query(self.scorer.encode_one(features), k=k)
+        distances, points = np.atleast_1d(distances), np.atleast_1d(points)
+
+        if self.vehicles is None:
+            nearest = self.points[points].with_columns(
+                distance=pl.Series(distances, dtype=pl.Float64)
+            )
+            return (
+                query_car_data(self.version)
+                .filter(
+                    pl.col("release_year").is_in(nearest.get_column("release_year")),
+                    pl.col("make").is_in(nearest.get_column("make")),
+                )
+                .select(neighbor_columns)
+                .join(nearest.lazy(), on=self.scorer.features, nulls_equal=True)
+                .sort(["distance", "make", "model", "release_year"])
+                .head(k)
+                .collect()
+            )
+
+        rows = []
+        row_distances = []
+        for distance, point in zip(distances, points, strict=True):
+            for row in range(self.offsets[point], self.offsets[point + 1]):
+                rows.append(row)
+                row_distances.append(float(distance))
+
+        return self.vehicles[rows[:k]].with_columns(
+            distance=pl.Series(row_distances[:k], dtype=pl.Float64)
+        )
+
+
+@st.cache_resource
+def load_neighbor_index(version: DataVersion) -> NeighborIndex:
+    """Build the similar vehicles index once per data version."""
+    from scipy.spatial import cKDTree  # noqa: PLC0415 only needed by this index
+
+    scorer = load_model(version)
+
+    if DATA_BACKEND == "lazy":
+        # Bounded memory: hold the distinct points only, not every vehicle
+        vehicles = None
+        offsets = []
+        points = (
+            query_car_data(version)
+            .select(scorer.features)
+            .unique(maintain_order=True)
+            .collect()
+        )
+    else:
+        vehicles = (
+            load_car_data(version)
+            .lazy()
+            .select(neighbor_columns)
+            .with_columns(point=pl.struct(scorer.features).rank("dense") - 1)
+            .sort("point", maintain_order=True)
+            .collect()
+        )
+        points = vehicles.filter(pl.col("point").is_first_distinct()).select(
+            scorer.features
+        )
+        counts = vehicles.group_by("point").len().sort("point").get_column("len")
+        offsets = [0, *itertools.accumulate(counts)]
+        vehicles = vehicles.drop("point")
+
+    return NeighborIndex(
+        tree=cKDTree(points.select(scorer.encoding_expressions()).to_numpy()),
+        scorer=scorer,
+        version=version,
+        points=points,
+        vehicles=vehicles,
+        offsets=offsets,
+    )
+
+
+class QueryCache:
+    """Thread-safe LRU cache of query results shared by every session.
+
+    Entries are evicted, least recently used first, once their estimated size exceeds
+    `max_bytes`. Cached frames are shared: derive new frames from them instead of
+    modifying them in place.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _estimated_size(cls, value: Any) -> int:
+        if isinstance(value, pl.DataFrame | pl.Series):
+            return value.estimated_size()
+        if isinstance(value, bytes):
+            return len(value)
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(
+                cls._estimated_size(key) + cls._estimated_size(item)
+                for key, item in value.items()
+            )
+        if isinstance(value, list | tuple) and value:
+            # Long sequences, like the rows of a service result, are sized from a sample
+            sample = value[:: max(len(value) // 100, 1)]
+            items_size = sum(map(cls._estimated_size, sample))
+            return sys.getsizeof(value) + items_size * len(value) // len(sample)
+        return sys.getsizeof(value)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return the cached value of `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Cache `value`, unless it alone is larger than the memory cap."""
+        size = self._estimated_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Evict the entries whose key matches `predicate` and return their number."""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._size -= self._entries.pop(key)[1]
+        return len(keys)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    """Process-wide cache of the filtered frames and widget statistics of the pages."""
+    return QueryCache(int(QUERY_CACHE_MB * 1024 * 1024))
 
 
 @st.cache_data
-def load_model(folder_path: str | Path = DATA_PATH) -> Pipeline:
-    """Load the trained scikit-learn Pipeline model from a pickle file."""
-    model_path = Path(folder_path) / "lasso_regression.pkl"
+def load_car_cube(version: DataVersion) -> pl.DataFrame:
+    """Load the pre-aggregated car cube (per year, vehicle class and fuel type) from a parquet file."""
+    return pl.read_parquet(version.folder_path / "car_cube.parquet")
+
+
+def rollup_car_cube(cube: pl.DataFrame, by: list[str]) -> pl.DataFrame:
+    """Aggregate the car cube over the given dimensions.
+
+    Means are recomputed from the stored sums and non-null counts so that they stay
+    exact at any level, and are null without any value.
+    """
+    return cube.group_by(by).agg(
+        model_count=pl.col("model_count").sum(),
+        **{
+            measure: (
+                pl.col(f"{measure}_sum").sum() / pl.col(f"{measure}_count").sum()
+            ).fill_nan(None)
+            for measure in cube_measures
+        },
+    )
+
+
+@dataclass(frozen=True)
+class KpiIndex:
+    """Prefix sums of the car cube over the release years, per vehicle class and fuel type.
+
+    `sums[name][c, f, i]` is the total of `name`, the `model_count` or the sum or
+    non-null count of a measure, over the vehicles of class `c` and fuel type `f` released before
+    `years[i]` (`i` may be `len(years)`). The totals of any year range are then the
+    difference of two slices, whatever the number of vehicles.
+    """
+
+    years: list[int]
+    vehicle_classes: list[str]
+    fuel_types: list[str]
+    sums: dict[str, np.ndarray]
+
+    @classmethod
+    def build(cls, cube: pl.DataFrame) -> "KpiIndex":
+        first_year = cube.get_column("release_year").min()
+        # Every year of the range, so that a year is an offset in the arrays
+        years = list(range(first_year, cube.get_column("release_year").max() + 1))
+        dimensions = {
+            column: cube.get_column(column).unique().sort().cast(pl.String).to_list()
+            for column in ("vehicle_class", "fuel_type")
+        }
+
+        indices = cube.select(
+            pl.col(column)
+            .cast(pl.String)
+            .replace_strict(values, list(range(len(values))))
+            for column, values in dimensions.items()
+        ).to_numpy()
+        position = (
+            indices[:, 0],
+            indices[:, 1],
+            cube.get_column("release_year").to_numpy() - first_year + 1,
+        )
+        shape = (*(len(values) for values in dimensions.values()), len(years) + 1)
+
+        sums = {}
+        for name in [
+            "model_count",
+            *(
+                f"{measure}_{stat}"
+                for stat in ("count", "sum")
+                for measure in cube_measures
+            ),
+        ]:
+            totals = np.zeros(shape)
+            np.add.at(totals, position, cube.get_column(name).fill_null(0).to_numpy())
+            sums[name] = totals.cumsum(axis=2)
+
+        return cls(
+            years=years,
+            vehicle_classes=dimensions["vehicle_class"],
+            fuel_types=dimensions["fuel_type"],
+            sums=sums,
+        )
+
+    def query(
+        self,
+        first_year: int,
+        last_year: int,
+        vehicle_classes: list[str] | None = None,
+        fuel_types: list[str] | None = None,
+    ) -> dict[str, float | None]:
+        """Model count and mean measures of the vehicles released in a year range.
+
+        `None` keeps every vehicle class or fuel type. Means are `None` without a value.
+        """
+        start = min(max(first_year - self.years[0], 0), len(self.years))
+        end = min(max(last_year - self.years[0] + 1, start), len(self.years))
+        selection = np.ix_(
+            _positions(self.vehicle_classes, vehicle_classes),
+            _positions(self.fuel_types, fuel_types),
+        )
+
+        totals = {
+            name: float((sums[:, :, end] - sums[:, :, start])[selection].sum())
+            for name, sums in self.sums.items()
+        }
+        counts = {
+            measure: round(totals[f"{measure}_count"]) for measure in cube_measures
+        }
+
+        return {
+            "model_count": round(totals["model_count"]),
+            **{
+                measure: totals[f"{measure}_sum"] / counts[measure]
+                if counts[measure]
+                else None
+                for measure in cube_measures
+            },
+        }
+
+
+def _positions(values: list[str], selected: list[str] | None) -> list[int]:
+    if selected is None:
+        return list(range(len(values)))
+    return [i for i, value in enumerate(values) if value in selected]
+
+
+@st.cache_resource
+def load_kpi_index(version: DataVersion) -> KpiIndex:
+    """Build the prefix sums of the car cube once per data version."""
+    return KpiIndex.build(load_car_cube(version))
+
+
+def _arrow_dataset(df: pl.DataFrame) -> bytes:
+    """Serialize chart data to the Arrow IPC stream that Streamlit sends to Vega-Lite.
+
+    Streamlit converts dataframes of a spec to Arrow on every call, through pandas, but
+    sends bytes as is. Strings are dictionary-encoded, like pandas categoricals, since
+    chart series repeat a few labels on every row.
+    """
+    import pyarrow as pa  # noqa: PLC0415 installed with streamlit
+
+    table = df.with_columns(pl.col(pl.Enum, pl.Categorical).cast(pl.String)).to_arrow(
+        compat_level=pl.CompatLevel.oldest()
+    )
+    table = table.cast(
+        pa.schema(
+            field.with_type(pa.dictionary(pa.int16(), pa.string()))
+            if pa.types.is_large_string(field.type)
+            else field
+            for field in table.schema
+        )
+    )
+
+    sink = pa.BufferOutputStream()
+    with pa.RecordBatchStreamWriter(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _vega_lite_spec(chart: Any, df: pl.DataFrame) -> dict[str, Any]:
+    """Vega-Lite spec of an Altair chart without data, plotting `df` serialized."""
+    import altair as alt  # noqa: PLC0415 only needed to build the specs
+
+    data = _arrow_dataset(df)
+    # Named after the content, like `st.altair_chart` does, so that the browser
+    # replaces the data of a chart when it changes
+    name = hashlib.md5(data, usedforsecurity=False).hexdigest()
+
+    # Set on the chart, so that the layers of a layered chart inherit it. The charts
+    # are fixed, so skip the schema validation of every selection
+    spec = chart.properties(data=alt.NamedData(name=name)).to_dict(validate=False)
+    # Without the size defaults of Altair's theme, like `st.altair_chart`
+    spec.pop("config", None)
+    spec["datasets"] = {name: data}
+    return spec
+
+
+def _year_axis(years: list[int]) -> Any:
+    import altair as alt  # noqa: PLC0415 only needed to build the specs
+
+    return alt.X(
+        "release_year:O",
+        title="Year",
+        axis=alt.Axis(labelAngle=0, values=years[::2]),
+    )
+
+
+@st.cache_resource
+def dashboard_chart_specs(
+    version: DataVersion,
+) -> dict[tuple[str, str | None], dict[str, Any]]:
+    """Vega-Lite specs of the dashboard charts, by chart id and selection.
+
+    Every chart, and the emissions charts of every fuel type and vehicle class, is
+    aggregated from the car cube and serialized once per data version, so that reruns
+    only look up specs. Datasets only hold the plotted columns, in compact types.
+    Pass each spec to `st.vega_lite_chart` as is.
+    """
+    import altair as alt  # noqa: PLC0415 only needed to build the specs
+
+    # Altair's dataframe checks see a pandas module that another thread is still
+    # importing as broken, so wait for that import to complete
+    importlib.import_module("pandas")
+
+    cube = load_car_cube(version)
+    yearly = rollup_car_cube(cube, ["release_year"]).sort("release_year")
+    years = yearly.get_column("release_year").to_list()
+    specs = {}
+
+    def proportions(by: str, over: str) -> pl.DataFrame:
+        return (
+            rollup_car_cube(cube, [by, over])
+            .select(
+                pl.col(by),
+                pl.col(over),
+                proportion=(
+                    pl.col("model_count") / pl.col("model_count").sum().over(by)
+                ).cast(pl.Float32),
+            )
+            .sort(by, over)
+        )
+
+    specs[("model_count", None)] = _vega_lite_spec(
+        alt.Chart()
+        .mark_line()
+        .encode(
+            x=_year_axis(years),
+            y=alt.Y("model_count:Q", title=None),
+            tooltip=[
+                alt.Tooltip("release_year:O", title="Year"),
+                alt.Tooltip("model_count:Q", title="Number of models"),
+            ],
+        )
+        .properties(title="Number of models released over time"),
+        yearly.select(
+            pl.col("release_year").cast(pl.Int16),
+            pl.col("model_count").cast(pl.Int32),
+        ),
+    )
+
+    specs[("vehicle_class", None)] = _vega_lite_spec(
+        alt.Chart()
+        .mark_area()
+        .encode(
+            x=_year_axis(years),
+            y=alt.Y(
+                "proportion:Q",
+                title="Proportion of Vehicle Class",
+                axis=alt.Axis(format="%"),
+            ),
+            color=alt.Color("vehicle_class:N", title="Vehicle Class"),
+            tooltip=[
+                alt.Tooltip("release_year:O", title="Year"),
+                alt.Tooltip("vehicle_class:N", title="Vehicle Class"),
+                alt.Tooltip("proportion:Q", title="Proportion", format=".2%"),
+            ],
+        )
+        .properties(title="Vehicle Class Proportion Over Time"),
+        proportions("release_year", "vehicle_class"),
+    )
+
+    specs[("fuel_type", None)] = _vega_lite_spec(
+        alt.Chart()
+        .mark_bar()
+        .encode(
+            x=_year_axis(years),
+            y=alt.Y(
+                "proportion:Q",
+                title="Percentage of Fuel Type",
+                axis=alt.Axis(format="%"),
+            ),
+            color=alt.Color("fuel_type:N", title="Fuel Type"),
+            tooltip=[
+                alt.Tooltip("release_year:O", title="Year"),
+                alt.Tooltip("fuel_type:N", title="Fuel Type"),
+                alt.Tooltip("proportion:Q", title="Percentage", format=".2%"),
+            ],
+        )
+        .properties(title="Vehicle Fuel Type Proportion Over Time"),
+        proportions("release_year", "fuel_type"),
+    )
+
+    # Order vehicle classes by count
+    class_order = (
+        rollup_car_cube(cube, ["vehicle_class"])
+        .sort("model_count", descending=True)
+        .get_column("vehicle_class")
+        .cast(pl.String)
+        .to_list()
+    )
+    specs[("fuel_by_class", None)] = _vega_lite_spec(
+        alt.Chart()
+        .mark_bar()
+        .encode(
+            x=alt.X(
+                "proportion:Q", title="Fuel Type Proportion", axis=alt.Axis(format="%")
+            ),
+            y=alt.Y("vehicle_class:O", sort=class_order, title=None),
+            color=alt.Color("fuel_type:N", title="Fuel Type"),
+            tooltip=[
+                alt.Tooltip("vehicle_class:O", title="Vehicle Type"),
+                alt.Tooltip("fuel_type:N", title="Fuel Type"),
+                alt.Tooltip("proportion:Q", title="Percentage", format=".2%"),
+            ],
+        )
+        .properties(title="Fuel Type Proportion versus Vehicle Type"),
+        proportions("vehicle_class", "fuel_type"),
+    )
+
+    # Emissions series of every fuel type and vehicle class, from a single rollup
+    emissions = rollup_car_cube(
+        cube, ["fuel_type", "vehicle_class", "release_year"]
+    ).select(
+        pl.col("fuel_type", "vehicle_class").cast(pl.String),
+        pl.col("release_year").cast(pl.Int16),
+        pl.col("emissions").cast(pl.Float32),
+    )
+
+    for chart_id, selected, series in (
+        ("emissions_by_class", "fuel_type", "vehicle_class"),
+        ("emissions_by_fuel", "vehicle_class", "fuel_type"),
+    ):
+        title = "Vehicle Type" if series == "vehicle_class" else "Fuel Type"
+        chart = (
+            alt.Chart()
+            .mark_line()
+            .encode(
+                x=_year_axis(years),
+                y=alt.Y("emissions:Q", title="Emissions (g/km)"),
+                color=alt.Color(f"{series}:N", title=title),
+                tooltip=[
+                    alt.Tooltip("release_year:O", title="Year"),
+                    alt.Tooltip(f"{series}:N", title=title),
+                    alt.Tooltip("emissions:Q", title="Emissions (g/km)", format=".2f"),
+                ],
+            )
+        )
+
+        for (value,), df in emissions.partition_by(selected, as_dict=True).items():
+            specs[(chart_id, value)] = _vega_lite_spec(
+                chart.properties(title=f"Average Emissions by {title} for {value}"),
+                df.select("release_year", series, "emissions").sort(
+                    "release_year", series
+                ),
+            )
+
+    return specs
+
+
+@st.cache_resource
+def load_model(version: DataVersion) -> LinearScorer:
+    """Load the Lasso model artifact exported by `src/export_model.py`.
+
+    The artifact is a JSON manifest and `.npz` arrays, read without scikit-learn.
+    """
+    return LinearScorer.load(version.folder_path / model_files[0])
+
+
+@dataclass(frozen=True)
+class Preloader:
+    """Background loads of the resources used by the pages, by resource name."""
+
+    futures: dict[str, Future]
+
+    def pending(self) -> list[str]:
+        return [name for name, future in self.futures.items() if not future.done()]
+
+
+def _timed_preload(name: str, task: Callable[[], Any]) -> None:
+    start = timer.perf_counter()
+    try:
+        task()
+    except Exception:
+        logger.exception("Preloading the %s failed", name)
+        raise
+    logger.info("Preloaded the %s in %.2fs", name, timer.perf_counter() - start)
+
+
+@st.cache_resource
+def start_preloading(version: DataVersion) -> Preloader:
+    """Start loading the data, model, indexes and chart library in background threads.
+
+    Runs once per data version, when the first session opens any page, so that the next
+    pages find their cached resources ready whichever page was opened first. Pages that
+    need a resource before it is ready wait for the load in progress.
+    """
+    tasks: dict[str, Callable[[], Any]] = {
+        "model": lambda: load_model(version),
+        "dashboard charts": lambda: dashboard_chart_specs(version),
+        "dashboard KPIs": lambda: load_kpi_index(version),
+        "fleet catalogue": lambda: load_fleet_catalogue(version),
+        "dropdown options": lambda: load_option_index(version),
+        "search index": lambda: load_search_index(version),
+        "similar vehicles index": lambda: load_neighbor_index(version),
+        "chart library": lambda: importlib.import_module("altair"),
+    }
+    if DATA_BACKEND == "memory":
+        tasks = {"car data": lambda: load_car_data(version), **tasks}
+
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="preload")
+    futures = {
+        name: executor.submit(_timed_preload, name, task)
+        for name, task in tasks.items()
+    }
+    executor.shutdown(wait=False)
+
+    return Preloader(futures)
+
+
+def show_readiness(preloader: Preloader) -> None:
+    """Show in the sidebar which resources are still loading, until all are ready."""
+
+    warming_up = bool(preloader.pending())
+
+    @st.fragment(run_every=1 if warming_up else None)
+    def readiness() -> None:
+        pending = preloader.pending()
+        if pending:
+            st.caption(f"⏳ Warming up: {', '.join(pending)}")
+        elif warming_up:
+            # Rerun the page so that the fragment stops polling
+            st.rerun()
+        else:
+            st.caption("✅ Ready")
+
+    with st.sidebar:
+        readiness()
+
+
+def _mentions(key: Hashable, value: Hashable) -> bool:
+    if isinstance(key, tuple):
+        return any(_mentions(item, value) for item in key)
+    return key == value
+
+
+class DataWatcher:
+    """Swap in updated data files without restarting the app.
+
+    The modification times and sizes of the dataset manifest and of the model artifact
+    are checked every `interval` seconds. Once they stop changing, the resources of the
+    new version are loaded in the background and only then is it published as
+    `current`, the version of new sessions. `live` keeps the previous version for the
+    sessions still on it, and the cached entries of older versions are evicted.
+    """
+
+    def __init__(self, folder_path: Path, interval: float) -> None:
+        self.folder_path = folder_path
+        self._paths = [
+            folder_path / "car_data" / "_manifest.json",
+            *(folder_path / name for name in model_files),
+        ]
+        self._stats = self._file_stats()
+        self.current = DataVersion.read(folder_path)
+        self.live = (self.current,)
+
+        if interval > 0:
+            threading.Thread(
+                target=self._run, args=(interval,), name="data-watcher", daemon=True
+            ).start()
+
+    def _file_stats(self) -> list[tuple[int, int] | None]:
+        stats = []
+        for path in self._paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stats.append(None)
+            else:
+                stats.append((stat.st_mtime_ns, stat.st_size))
+        return stats
+
+    def _run(self, interval: float) -> None:
+        pending = None
+        while True:
+            timer.sleep(interval)
+            stats = self._file_stats()
+            if stats == self._stats:
+                pending = None
+            elif stats != pending:
+                # Wait for one check without changes, the files may still be written
+                pending = stats
+            else:
+                self._stats = stats
+                pending = None
+                try:
+                    self.swap(DataVersion.read(self.folder_path))
+                except Exception:
+                    logger.exception(
+                        "Loading the updated data of %s failed, keeping version %s",
+                        self.folder_path,
+                        self.current.fingerprint,
+                    )
+
+    def swap(self, version: DataVersion) -> None:
+        """Load the resources of `version`, then make it the current version."""
+        if version == self.current:
+            return
+
+        start = timer.perf_counter()
+        for future in start_preloading(version).futures.values():
+            future.result()
+
+        stale = set(self.live) - {self.current, version}
+        # Sessions look their version up in `live` before falling back to `current`
+        self.live = (self.current, version)
+        self.current = version
+        for stale_version in stale:
+            self.evict(stale_version)
+
+        logger.info(
+            "Swapped in data version %s in %.2fs",
+            version.fingerprint,
+            timer.perf_counter() - start,
+        )
+
+    @staticmethod
+    def evict(version: DataVersion) -> None:
+        """Drop the cached resources and query results of `version`."""
+        for loader in (
+            start_preloading,
+            load_car_data,
+            load_option_index,
+            load_search_index,
+            load_neighbor_index,
+            load_car_cube,
+            load_kpi_index,
+            dashboard_chart_specs,
+            load_model,
+            load_fleet_catalogue,
+        ):
+            loader.clear(version)
+        # Their entries are also keyed by the vehicle, they cannot be cleared by version
+        predict_sensitivity.clear()
+        sensitivity_chart_specs.clear()
+
+        evicted = get_query_cache().discard(lambda key: _mentions(key, version))
+        logger.info(
+            "Evicted data version %s and %d query results", version.fingerprint, evicted
+        )
+
+
+@st.cache_resource
+def start_data_watcher(folder_path: str | Path = DATA_PATH) -> DataWatcher:
+    """Start watching `folder_path` for updated data, once per process."""
+    return DataWatcher(Path(folder_path), WATCH_INTERVAL)
+
+
+def session_data_version(folder_path: str | Path = DATA_PATH) -> DataVersion:
+    """Version of the data read by the current session.
+
+    A session stays on the version it started with, so that its pages and results stay
+    consistent, until the user switches to updated data from the sidebar or its version
+    is evicted. Call it before loading any resource of a page.
+    """
+    watcher = start_data_watcher(folder_path)
+    version = st.session_state.get("data_version")
+
+    if version not in watcher.live:
+        version = watcher.current
+    elif version != watcher.current:
+
+        def switch() -> None:
+            st.session_state["data_version"] = watcher.current
+
+        with st.sidebar:
+            st.info("Updated data is available.")
+            st.button(
+                "Switch to the updated data", icon=":material/refresh:", on_click=switch
+            )
+
+    st.session_state["data_version"] = version
+    return version
+
+
+# Numerical features varied one at a time by `predict_sensitivity`, with their grid step
+sensitivity_features = {
+    "engine_size": 0.1,
+    "cylinders": 1,
+    "gears": 1,
+    "release_year": 1,
+}
+
+
+@st.cache_data(max_entries=1_000)
+def predict_sensitivity(
+    car_features: dict[str, Any], version: DataVersion
+) -> pl.DataFrame:
+    """Predict every target while varying one numerical feature at a time.
+
+    Each feature of `sensitivity_features` spans the range of the car data with the
+    other features of `car_features` held fixed, and the whole grid is scored in a
+    single vectorized pass.
+
+    Returns:
+        One row per grid point: the `varied` feature, its `value` and the predictions.
+    """
+    index = load_option_index(version)
+    model = load_model(version)
+
+    grids = []
+    for feature, step in sensitivity_features.items():
+        low, high = index.bounds[feature]
+        values = pl.arange(0, round((high - low) / step) + 1, eager=True) * step + low
+        grids.append(
+            pl.DataFrame({"value": values.cast(pl.Float64)}).with_columns(
+                varied=pl.lit(feature),
+                **{
+                    name: pl.col("value") if name == feature else pl.lit(value)
+                    for name, value in car_features.items()
+                },
+            )
+        )
+
+    grid = pl.concat(grids, how="diagonal_relaxed")
+    return grid.select("varied", "value").hstack(model.predict_frame(grid))
+
+
+# Consumption targets plotted by the what-if charts, with their display name
+_consumption_names = {"fc_mixed": "Mixed", "fc_city": "City", "fc_highway": "Highway"}
+
+
+@st.cache_resource(max_entries=1_000)
+def sensitivity_chart_specs(
+    car_features: dict[str, Any], version: DataVersion
+) -> dict[tuple[str, str], dict[str, Any]]:
+    """Vega-Lite specs of the what-if curves of a vehicle, by varied feature and measure.
+
+    The curves of `predict_sensitivity` are plotted as a "consumption" and an
+    "emissions" chart per feature, with a rule at the value of the vehicle, once per
+    vehicle so that reruns only look up specs. Features without a value in
+    `car_features` have no chart. Pass each spec to `st.vega_lite_chart` as is.
+    """
+    import altair as alt  # noqa: PLC0415 only needed to build the specs
+
+    # Same concurrent pandas import as in `dashboard_chart_specs`
+    importlib.import_module("pandas")
+
+    sensitivity = predict_sensitivity(car_features, version)
+    specs = {}
+
+    for feature in sensitivity_features:
+        if car_features.get(feature) is None:
+            continue
+
+        curves = sensitivity.filter(pl.col("varied") == feature)
+        title = display_columns_name_mapping[feature]
+        # One rule, instead of one per point of the curves
+        current_value = (
+            alt.Chart()
+            .mark_rule(strokeDash=[4, 4])
+            .encode(x=alt.datum(float(car_features[feature])))
+            .transform_aggregate(points="count()")
+        )
+
+        specs[(feature, "consumption")] = _vega_lite_spec(
+            alt.layer(
+                alt.Chart()
+                .mark_line()
+                .encode(
+                    x=alt.X("value:Q", title=title),
+                    y=alt.Y("prediction:Q", title="Consumption (L/100 km)"),
+                    color=alt.Color("consumption:N", title=None),
+                    tooltip=[
+                        alt.Tooltip("value:Q", title=title),
+                        alt.Tooltip("consumption:N", title="Consumption"),
+                        alt.Tooltip("prediction:Q", title="L/100 km", format=".1f"),
+                    ],
+                ),
+                current_value,
+            ),
+            curves.unpivot(
+                index="value",
+                on=list(_consumption_names),
+                variable_name="consumption",
+                value_name="prediction",
+            ).select(
+                pl.col("value").cast(pl.Float32),
+                pl.col("consumption").replace_strict(_consumption_names),
+                pl.col("prediction").cast(pl.Float32),
+            ),
+        )
+
+        specs[(feature, "emissions")] = _vega_lite_spec(
+            alt.layer(
+                alt.Chart()
+                .mark_line()
+                .encode(
+                    x=alt.X("value:Q", title=title),
+                    y=alt.Y("emissions:Q", title="Emissions (g/km)"),
+                    tooltip=[
+                        alt.Tooltip("value:Q", title=title),
+                        alt.Tooltip(
+                            "emissions:Q", title="Emissions (g/km)", format=".0f"
+                        ),
+                    ],
+                ),
+                current_value,
+            ),
+            curves.select(pl.col("value", "emissions").cast(pl.Float32)),
+        )
+
+    return specs
+
+
+def predict_batch(
+    input_path: str | Path,
+    output_path: str | Path,
+    chunk_size: int = 100_000,
+    folder_path: str | Path = DATA_PATH,
+) -> int:
+    """Predict emissions and consumptions for every vehicle of a CSV or Parquet file.
+
+    The file is streamed in chunks of `chunk_size` rows, each chunk being scored in one
+    vectorized pass, and the input columns are written to `output_path` as Parquet
+    together with one `predicted_<target>` column per target.
+
+    Returns:
+        The number of scored vehicles.
+    """
+    input_path = Path(input_path)
+    model = load_model(DataVersion.read(folder_path))
+
+    if input_path.suffix == ".parquet":
+        vehicles = pl.scan_parquet(input_path)
+    elif input_path.suffix == ".csv":
+        vehicles = pl.scan_csv(input_path)
+    else:
+        raise ValueError(
+            f"Unsupported file type {input_path.suffix!r}, expected .csv or .parquet"
+        )
+
+    missing_columns = set(model.features) - set(vehicles.collect_schema().names())
+    if missing_columns:
+        raise ValueError(
+            f"Missing feature columns in {input_path}: {sorted(missing_columns)}"
+        )
+
+    start = timer.perf_counter()
+    with pl.Config(streaming_chunk_size=chunk_size):
+        vehicles.with_columns(
+            expr.name.prefix("predicted_") for expr in model.expressions()
+        ).sink_parquet(output_path, row_group_size=chunk_size)
+    elapsed = timer.perf_counter() - start
+
+    row_count = pl.scan_parquet(output_path).select(pl.len()).collect().item()
+    logger.info(
+        "Scored %d vehicles in %.2fs (%.0f rows/s)",
+        row_count,
+        elapsed,
+        row_count / elapsed if elapsed else float("inf"),
+    )
+
+    return row_count
+
+
+@st.cache_resource
+def load_fleet_catalogue(version: DataVersion) -> pl.DataFrame:
+    """Mean consumption and emissions of every (release year, make, model), sorted by key."""
+    return (
+        query_car_data(version)
+        .group_by(fleet_keys)
+        .agg(pl.col("fc_mixed", "emissions").mean())
+        .with_columns(pl.col("make", "model").cast(pl.String))
+        .sort(fleet_keys)
+        .collect()
+    )
+
+
+def fleet_fuel_cost(fleet: pl.DataFrame, version: DataVersion) -> pl.DataFrame:
+    """Annual fuel use, fuel cost and CO2 emissions of every vehicle of a fleet.
+
+    Vehicles are looked up in the catalogue of the car data by release year, make and
+    model. The others are scored by the model, using the model feature columns that
+    `fleet` holds, if any. The `source` column tells which one was used.
+
+    Raises:
+        ValueError: If a column of `fleet_columns` is missing.
+    """
+    missing_columns = set(fleet_columns) - set(fleet.columns)
+    if missing_columns:
+        raise ValueError(f"Missing fleet columns: {sorted(missing_columns)}")
+
+    model = load_model(version)
+    predictions = {
+        expr.meta.output_name(): expr
+        for expr in model.expressions()
+        if expr.meta.output_name() in ("fc_mixed", "emissions")
+    }
+    feature_columns = [f for f in model.features if f in fleet.columns]
+
+    vehicles = fleet.select(
+        *(pl.col(column).cast(dtype) for column, dtype in fleet_columns.items()),
+        *(pl.col(f) for f in feature_columns if f not in fleet_columns),
+    ).with_columns(
+        pl.lit(None).alias(f) for f in model.features if f not in feature_columns
+    )
+
+    return (
+        vehicles.join(
+            load_fleet_catalogue(version),
+            on=fleet_keys,
+            how="left",
+            maintain_order="left",
+        )
+        .select(
+            *fleet_columns,
+            source=pl.when(pl.col("fc_mixed").is_not_null())
+            .then(pl.lit("catalogue"))
+            .otherwise(pl.lit("model")),
+            fc_mixed=pl.col("fc_mixed").fill_null(predictions["fc_mixed"]),
+            emissions=pl.col("emissions").fill_null(predictions["emissions"]),
+        )
+        .with_columns(fuel_l=pl.col("fc_mixed") * pl.col("annual_km") / 100)
+        .with_columns(
+            fuel_cost=pl.col("fuel_l") * pl.col("fuel_price"),
+            co2_kg=pl.col("emissions") * pl.col("annual_km") / 1000,
+        )
+    )
+
+
+class _Profile(threading.local):
+    """Spans of the rerun running in the current thread, None when not profiling."""
+
+    spans: list[dict[str, Any]] | None = None
+    page = ""
+    start = 0.0
+    depth = 0
+
+
+_profile = _Profile()
+_no_span = nullcontext()
+_timing_log_lock = threading.Lock()
+
+
+def start_profiling(page: str) -> None:
+    """Start recording the spans of a page rerun, if profiling is enabled."""
+    enabled = PROFILE_ENABLED or st.query_params.get("profile") == "1"
+    _profile.spans = [] if enabled else None
+    _profile.page = page
+    _profile.start = timer.perf_counter()
+    _profile.depth = 0
+
+
+@contextmanager
+def _record_span(name: str):
+    depth = _profile.depth
+    _profile.depth += 1
+    start = timer.perf_counter()
+    try:
+        yield
+    finally:
+        end = timer.perf_counter()
+        _profile.depth = depth
+        if _profile.spans is not None:
+            _profile.spans.append(
+                {
+                    "name": name,
+                    "depth": depth,
+                    "start_ms": (start - _profile.start) * 1000,
+                    "duration_ms": (end - start) * 1000,
+                }
+            )
+
+
+def span(name: str) -> AbstractContextManager:
+    """Time the enclosed block as part of the current rerun.
+
+    When profiling is disabled, this returns a shared no-op context manager.
+
+    Example:
+        ```python
+        with span("load_car_cube"):
+            cube = load_car_cube(version)
+        ```
+    """
+    if _profile.spans is None:
+        return _no_span
+    return _record_span(name)
+
+
+def _timing_logger() -> logging.Logger:
+    timing_logger = logging.getLogger("fuel_app.timings")
+
+    with _timing_log_lock:
+        if not timing_logger.handlers:
+            PROFILE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+            handler = logging.FileHandler(PROFILE_LOG_PATH)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            timing_logger.addHandler(handler)
+            timing_logger.setLevel(logging.INFO)
+            timing_logger.propagate = False
+
+    return timing_logger
+
+
+def show_profiler(in_sidebar: bool = True) -> None:
+    """Log the spans of the current rerun and show them as a waterfall in the sidebar.
+
+    Each rerun is appended to `PROFILE_LOG_PATH` as one JSON record. Nothing is shown
+    when profiling is disabled. Fragments cannot write to the sidebar, so their reruns
+    show the waterfall `in_sidebar=False`, in their own body.
+    """
+    spans = _profile.spans
+    if spans is None:
+        return
+    _profile.spans = None
+
+    total_ms = (timer.perf_counter() - _profile.start) * 1000
+    cache_stats = get_query_cache().stats()
+    _timing_logger().info(
+        json.dumps(
+            {
+                "timestamp": datetime.now(UTC).isoformat(),
+                "page": _profile.page,
+                "total_ms": total_ms,
+                "spans": spans,
+                "query_cache": cache_stats,
+            }
+        )
+    )
+
+    import altair as alt  # noqa: PLC0415 only needed when profiling
+
+    waterfall = pl.DataFrame(
+        spans,
+        schema={
+            "name": pl.String,
+            "depth": pl.Int64,
+            "start_ms": pl.Float64,
+            "duration_ms": pl.Float64,
+        },
+    ).with_columns(end_ms=pl.col("start_ms") + pl.col("duration_ms"))
+
+    expander = st.sidebar.expander if in_sidebar else st.expander
+    with expander("⏱️ Profiler", expanded=True):
+        st.caption(
+            f"Rerun of {_profile.page} took {total_ms:.0f} ms. Query cache: "
+            f"{cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['bytes'] / 1024**2:.1f} of "
+            f"{cache_stats['max_bytes'] / 1024**2:.0f} MB used"
+        )
+        chart = (
+            alt.Chart(waterfall)
+            .mark_bar()
+            .encode(
+                x=alt.X("start_ms:Q", title="ms since rerun start"),
+                x2="end_ms:Q",
+                y=alt.Y("name:N", sort=None, title=None),
+                color=alt.Color("depth:O", legend=None),
+                tooltip=[
+                    alt.Tooltip("name:N", title="Span"),
+                    alt.Tooltip("start_ms:Q", title="Start (ms)", format=".1f"),
+                    alt.Tooltip("duration_ms:Q", title="Duration (ms)", format=".1f"),
+                ],
+            )
+        )
+        st.altair_chart(chart, width="stretch")
+
 
-    with model_path.open("rb") as f:
-        return pickle.load(f)  # noqa: S301 deserialization is safe here
+def profiled_fragment(
+    func: Callable[..., None] | None = None, *, run_every: float | None = None
+) -> Callable[..., None]:
+    """Turn `func` into a `st.fragment` whose own reruns are profiled too.
+
+    When the page reruns, the spans of the fragment are part of the page profile. When
+    only the fragment reruns, it is profiled as `<page>/<function name>`. Like
+    `st.fragment`, it can be used with arguments, such as `run_every` to rerun the
+    fragment every `run_every` seconds.
+    """
+    if func is None:
+        return functools.partial(profiled_fragment, run_every=run_every)
+
+    @functools.wraps(func)
+    def profiled(*args: Any, **kwargs: Any) -> None:
+        if _profile.spans is not None:
+            func(*args, **kwargs)
+            return
+
+        page = _profile.page
+        start_profiling(f"{page}/{func.__name__}")
+        try:
+            func(*args, **kwargs)
+            show_profiler(in_sidebar=False)
+        finally:
+            _profile.spans = None
+            _profile.page = page
+
+    return st.fragment(profiled, run_every=run_every)
+
+
+def page_footer(version: DataVersion) -> None:
+    """End a page: show its profile, then load the resources of every page.
+
+    Background loads start once the page is rendered, so that they do not slow down
+    the first page opened.
+    """
+    show_profiler()
+    show_readiness(start_preloading(version))
 
 
 def percentage_change(new_value: float, old_value: float) -> float:
@@ -50,8 +1593,20 @@ def percentage_change(new_value: float, old_value: float) -> float:
     return (new_value - old_value) / old_value
 
 
-def _multiselect_options(df: pl.DataFrame, column: str) -> list[Any]:
-    return df.get_column(column).drop_nulls().unique().sort().to_list()
+# Streamlit widget values before the first render of a filter widget
+_MISSING = object()
+
+# Dictionary-encoded columns with more distinct values are searched by pattern
+_MAX_CATEGORY_OPTIONS = 50
+
+# Rows written at once by the exports of `dataframe_explorer`
+_EXPORT_BATCH_ROWS = 50_000
+
+# Export formats of `dataframe_explorer`, with their file extension and MIME type
+export_formats = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
 
 
 def _default_slider_step(min_value: int | float, max_value: int | float) -> int | float:
@@ -62,26 +1617,273 @@ def _default_slider_step(min_value: int | float, max_value: int | float) -> int
     return step if step > 0 else 0.01
 
 
-def _default_key_prefix(df: pl.DataFrame, available_columns: list[str]) -> str:
-    schema_signature = tuple((name, repr(dtype)) for name, dtype in df.schema.items())
+def _default_key_prefix(schema: pl.Schema, available_columns: list[str]) -> str:
+    schema_signature = tuple((name, repr(dtype)) for name, dtype in schema.items())
     key_material = repr((tuple(available_columns), schema_signature)).encode()
     return hashlib.md5(key_material, usedforsecurity=False).hexdigest()
 
 
+def _is_dictionary_encoded(dtype: pl.DataType) -> bool:
+    return isinstance(dtype, (pl.Categorical, pl.Enum))
+
+
+def _widget_condition(
+    value: Any, dtype: pl.DataType, case_sensitive: bool
+) -> tuple | None:
+    """Translate the value of a filter widget into a hashable filter condition.
+
+    Widgets that were never rendered filter on their default value, which keeps every
+    non-null value except for text patterns.
+    """
+    if value is _MISSING:
+        if dtype.is_numeric() or dtype.is_temporal() or _is_dictionary_encoded(dtype):
+            return ("is_not_null",)
+        return None
+
+    if isinstance(value, list):
+        return ("is_in", tuple(value))
+
+    if isinstance(value, str):
+        if not value:
+            return None
+        pattern = value if case_sensitive else f"(?i){re.escape(value)}"
+        return ("contains", pattern, case_sensitive)
+
+    if len(value) != 2:
+        return None
+
+    start_value, end_value = value
+    if dtype == pl.Datetime:
+        start_value = datetime.combine(start_value, time.min)
+        end_value = datetime.combine(end_value, time.max)
+
+    return ("is_between", start_value, end_value)
+
+
+def _condition_expression(
+    column: str, condition: tuple, pattern_filters: dict[str, pl.Expr]
+) -> pl.Expr:
+    kind, *args = condition
+
+    if kind == "is_not_null":
+        return pl.col(column).is_not_null()
+    if kind == "is_in":
+        return pl.col(column).is_in(args[0])
+    if kind == "is_between":
+        return pl.col(column).is_between(*args)
+
+    if column in pattern_filters:
+        return pattern_filters[column]
+
+    pattern, literal = args
+    return (
+        pl.col(column)
+        .cast(pl.String)
+        .fill_null("")
+        .str.contains(pattern, literal=literal)
+    )
+
+
+def filter_spec(conditions: list[tuple[str, tuple | None]]) -> tuple:
+    """Canonical, hashable form of filter conditions.
+
+    Two sets of conditions selecting the same rows, whatever the order of the widgets or
+    of the selected values, share the same spec.
+    """
+    spec = []
+
+    for column, condition in conditions:
+        if condition is None:
+            continue
+        if condition[0] == "is_in":
+            condition = ("is_in", tuple(sorted(set(condition[1]))))
+        spec.append((column, condition))
+
+    return tuple(sorted(spec))
+
+
+def _distinct_strings(
+    lf: pl.LazyFrame, column: str, dtype: pl.DataType, cache_key: Hashable | None
+) -> pl.Series:
+    """Distinct non-null values of a column as strings, from its dictionary if any."""
+    if isinstance(dtype, pl.Enum):
+        return dtype.categories
+
+    cache = get_query_cache() if cache_key is not None else None
+    key = (cache_key, "distinct", column)
+    values = cache.get(key) if cache is not None else None
+
+    if values is None:
+        values = (
+            lf.select(pl.col(column).cast(pl.String).drop_nulls().unique())
+            .collect()
+            .to_series()
+        )
+        if cache is not None:
+            cache.put(key, values)
+
+    return values
+
+
+def _narrows(previous: tuple[str, bool], current: tuple[str, bool]) -> bool:
+    """Whether every match of the `current` pattern also matches the `previous` one."""
+    (previous_pattern, previous_literal), (pattern, literal) = previous, current
+    if previous_literal != literal:
+        return False
+
+    # Case-insensitive patterns are escaped text behind an inline flag
+    flag = "" if literal else "(?i)"
+    return previous_pattern[len(flag) :] in pattern[len(flag) :]
+
+
+def _pattern_filter(
+    lf: pl.LazyFrame,
+    column: str,
+    dtype: pl.DataType,
+    condition: tuple,
+    cache_key: Hashable | None,
+) -> pl.Expr:
+    """Turn a text pattern condition into a membership filter on the matching values.
+
+    The pattern is searched in the distinct values of the column instead of every row.
+    With a `cache_key`, the matches are kept in the session so that a pattern extending
+    the previous one only searches the previous matches.
+    """
+    _, pattern, literal = condition
+    searches = st.session_state.setdefault("_explorer_pattern_searches", {})
+    previous = searches.get((cache_key, column)) if cache_key is not None else None
+
+    if previous is not None and previous[0] == (pattern, literal):
+        matches = previous[1]
+    elif previous is not None and _narrows(previous[0], (pattern, literal)):
+        matches = previous[1].filter(previous[1].str.contains(pattern, literal=literal))
+    else:
+        values = _distinct_strings(lf, column, dtype, cache_key)
+        matches = values.filter(values.str.contains(pattern, literal=literal))
+
+    if cache_key is not None:
+        searches[(cache_key, column)] = ((pattern, literal), matches)
+
+    # Dictionary-encoded columns compare codes, other columns are matched as strings
+    if _is_dictionary_encoded(dtype) or dtype == pl.String:
+        return pl.col(column).is_in(matches.implode())
+    return pl.col(column).cast(pl.String).is_in(matches.implode())
+
+
+def combined_filter(
+    conditions: list[tuple[str, tuple | None]],
+    pattern_filters: dict[str, pl.Expr] | None = None,
+) -> pl.Expr:
+    """Expression keeping the rows that match every `(column, condition)` pair.
+
+    Conditions are those of the `dataframe_explorer` widgets, or the pairs of a
+    `filter_spec`. None conditions keep every row.
+    """
+    return pl.all_horizontal(
+        pl.lit(True),
+        *(
+            _condition_expression(column, condition, pattern_filters or {})
+            for column, condition in conditions
+            if condition is not None
+        ),
+    )
+
+
+def _widget_statistics(
+    lf: pl.LazyFrame,
+    schema: pl.Schema,
+    columns: list[str],
+    conditions: list[tuple[str, tuple | None]],
+    start: int = 0,
+    cache_key: Hashable | None = None,
+    pattern_filters: dict[str, pl.Expr] | None = None,
+) -> list[dict[str, Any]]:
+    """Compute the statistics of the filter widgets from `start` in a single batched query.
+
+    The widget of `columns[i]` is based on the rows left by the first `i` conditions.
+    With a `cache_key` identifying `lf`, statistics are looked up in the query cache
+    first and only the missing ones are computed.
+    """
+    cache = get_query_cache() if cache_key is not None else None
+    statistics: list[dict[str, Any] | None] = []
+    keys = []
+    queries = []
+
+    for i, column in enumerate(columns[start:], start=start):
+        key = (cache_key, "statistics", column, filter_spec(conditions[:i]))
+        cached = cache.get(key) if cache is not None else None
+        statistics.append(cached)
+        if cached is not None:
+            continue
+
+        dtype = schema[column]
+        # Only low-cardinality columns are shown as a multiselect
+        options = (
+            pl.col(column)
+            .drop_nulls()
+            .unique()
+            .sort()
+            .head(_MAX_CATEGORY_OPTIONS if _is_dictionary_encoded(dtype) else 10)
+        )
+
+        stats = [
+            pl.len().alias("len"),
+            pl.col(column).null_count().alias("null_count"),
+            pl.col(column).n_unique().alias("n_unique"),
+            options.implode().alias("options"),
+        ]
+        if dtype.is_numeric() or dtype.is_temporal():
+            stats += [
+                pl.col(column).min().alias("min"),
+                pl.col(column).max().alias("max"),
+            ]
+
+        keys.append(key)
+        queries.append(
+            lf.filter(combined_filter(conditions[:i], pattern_filters)).select(stats)
+        )
+
+    # Fill the cache misses in order with the rows of the batched query
+    computed = zip(keys, pl.collect_all(queries) if queries else [], strict=True)
+    for i in [i for i, stats in enumerate(statistics) if stats is None]:
+        key, frame = next(computed)
+        statistics[i] = frame.row(0, named=True)
+        if cache is not None:
+            cache.put(key, statistics[i])
+
+    return statistics
+
+
 def dataframe_explorer(
-    df: pl.DataFrame,
+    df: pl.DataFrame | pl.LazyFrame,
     case_sensitive: bool = True,
     excluded_columns: list[str] | None = None,
     key_prefix: str | None = None,
+    max_rows: int | None = None,
+    cache_key: Hashable | None = None,
+    export_file_name: str | None = None,
 ) -> pl.DataFrame:
-    """Add Streamlit controls to filter a Polars dataframe by selected columns."""
-    filtered_df = df
+    """Add Streamlit controls to filter a Polars dataframe by selected columns.
+
+    The widgets' filters are combined into a single lazy query. The statistics the
+    widgets need (options, ranges, null counts) are computed together before rendering
+    them, and only the final filtered dataframe, limited to `max_rows` rows if given,
+    is materialized.
+
+    When `cache_key` identifies the content of `df`, the statistics and the filtered
+    dataframe are memoized in the process-wide query cache under the `filter_spec` of
+    the widgets, so that sessions running the same filters skip the Polars work.
+
+    With an `export_file_name`, download buttons export the filtered dataframe to CSV
+    or Parquet. A file is only written when its button is clicked and, with a
+    `cache_key`, kept in the query cache for the next downloads of the same filters.
+    """
+    lf = df.lazy()
+    schema = lf.collect_schema()
     available_columns = [
-        column
-        for column in filtered_df.columns
-        if column not in (excluded_columns or [])
+        column for column in schema.names() if column not in (excluded_columns or [])
     ]
-    widget_key_base = key_prefix or _default_key_prefix(filtered_df, available_columns)
+    widget_key_base = key_prefix or _default_key_prefix(schema, available_columns)
 
     with st.container():
         selected_columns = st.multiselect(
@@ -90,100 +1892,205 @@ def dataframe_explorer(
             key=f"{widget_key_base}_multiselect",
         )
 
-        for column in selected_columns:
+        # Assume every widget keeps its value from the previous rerun
+        conditions = [
+            (
+                column,
+                _widget_condition(
+                    st.session_state.get(f"{widget_key_base}_{column}", _MISSING),
+                    schema[column],
+                    case_sensitive,
+                ),
+            )
+            for column in selected_columns
+        ]
+        # Text patterns are searched once in the distinct values of their column
+        with span("explorer.patterns"):
+            pattern_filters = {
+                column: _pattern_filter(
+                    lf, column, schema[column], condition, cache_key
+                )
+                for column, condition in conditions
+                if condition is not None and condition[0] == "contains"
+            }
+        with span("explorer.statistics"):
+            statistics = _widget_statistics(
+                lf,
+                schema,
+                selected_columns,
+                conditions,
+                cache_key=cache_key,
+                pattern_filters=pattern_filters,
+            )
+
+        for i, column in enumerate(selected_columns):
             left, right = st.columns((1, 20))
-            column_series = filtered_df.get_column(column)
-            dtype = filtered_df.schema[column]
+            left.write("↳")
+            stats = statistics[i]
+            dtype = schema[column]
+            key = f"{widget_key_base}_{column}"
 
             # Streamlit filter widgets need at least one non-null value to render safely.
-            if (
-                column_series.is_empty()
-                or column_series.null_count() == column_series.len()
-            ):
-                left.write("↳")
+            if stats["len"] == 0 or stats["null_count"] == stats["len"]:
                 right.caption(f"No values left for {column} after the current filters.")
-                continue
-
-            if dtype == pl.Categorical or column_series.n_unique() < 10:
-                left.write("↳")
-                options = _multiselect_options(filtered_df, column)
+                condition = None
+            elif stats["n_unique"] < 10 or (
+                _is_dictionary_encoded(dtype)
+                and stats["n_unique"] <= _MAX_CATEGORY_OPTIONS
+            ):
                 selected_values = right.multiselect(
                     f"Values for {column}",
-                    options,
-                    default=options,
-                    key=f"{widget_key_base}_{column}",
+                    stats["options"],
+                    default=stats["options"],
+                    key=key,
                 )
-                filtered_df = filtered_df.filter(pl.col(column).is_in(selected_values))
+                condition = _widget_condition(selected_values, dtype, case_sensitive)
             elif dtype.is_numeric():
-                left.write("↳")
-                min_value = column_series.min()
-                max_value = column_series.max()
+                min_value = stats["min"]
+                max_value = stats["max"]
 
                 if min_value == max_value:
                     selected_values = right.multiselect(
                         f"Values for {column}",
                         [min_value],
                         default=[min_value],
-                        key=f"{widget_key_base}_{column}",
+                        key=key,
                     )
-                    filtered_df = filtered_df.filter(
-                        pl.col(column).is_in(selected_values)
+                    condition = _widget_condition(
+                        selected_values, dtype, case_sensitive
                     )
-                    continue
-
-                selected_range = right.slider(
-                    f"Values for {column}",
-                    min_value=min_value,
-                    max_value=max_value,
-                    value=(min_value, max_value),
-                    step=_default_slider_step(min_value, max_value),
-                    key=f"{widget_key_base}_{column}",
-                )
-                filtered_df = filtered_df.filter(
-                    pl.col(column).is_between(*selected_range)
-                )
+                else:
+                    selected_range = right.slider(
+                        f"Values for {column}",
+                        min_value=min_value,
+                        max_value=max_value,
+                        value=(min_value, max_value),
+                        step=_default_slider_step(min_value, max_value),
+                        key=key,
+                    )
+                    condition = _widget_condition(selected_range, dtype, case_sensitive)
             elif dtype in (pl.Date, pl.Datetime):
-                left.write("↳")
-                min_value = column_series.min()
-                max_value = column_series.max()
                 selected_dates = right.date_input(
                     f"Values for {column}",
-                    value=(min_value, max_value),
-                    key=f"{widget_key_base}_{column}",
+                    value=(stats["min"], stats["max"]),
+                    key=key,
                 )
+                condition = _widget_condition(selected_dates, dtype, case_sensitive)
+            else:
+                search_pattern = right.text_input(f"Pattern in {column}", key=key)
+                condition = _widget_condition(search_pattern, dtype, case_sensitive)
+                if condition is not None:
+                    with span("explorer.patterns"):
+                        pattern_filters[column] = _pattern_filter(
+                            lf, column, dtype, condition, cache_key
+                        )
 
-                if len(selected_dates) != 2:
-                    continue
+            # A widget that did not keep its previous value (first render, reset by
+            # Streamlit) changes the rows seen by the next widgets, so replan them
+            if condition != conditions[i][1]:
+                conditions[i] = (column, condition)
+                if i + 1 < len(selected_columns):
+                    with span("explorer.statistics"):
+                        statistics[i + 1 :] = _widget_statistics(
+                            lf,
+                            schema,
+                            selected_columns,
+                            conditions,
+                            start=i + 1,
+                            cache_key=cache_key,
+                            pattern_filters=pattern_filters,
+                        )
 
-                start_date, end_date = selected_dates
-                if dtype == pl.Datetime:
-                    start_value = datetime.combine(start_date, time.min)
-                    end_value = datetime.combine(end_date, time.max)
-                else:
-                    start_value = start_date
-                    end_value = end_date
+    result = _explorer_result(
+        df, lf, conditions, pattern_filters, max_rows=max_rows, cache_key=cache_key
+    )
 
-                filtered_df = filtered_df.filter(
-                    pl.col(column).is_between(start_value, end_value)
-                )
-            else:
-                left.write("↳")
-                search_pattern = right.text_input(
-                    f"Pattern in {column}",
-                    key=f"{widget_key_base}_{column}",
+    if export_file_name is not None:
+        spec = filter_spec(conditions)
+        with st.container(horizontal=True):
+            for label, (extension, mime) in export_formats.items():
+                st.download_button(
+                    f"Download {label}",
+                    _deferred_export(
+                        result,
+                        extension,
+                        None
+                        if cache_key is None
+                        else (cache_key, "export", spec, max_rows, extension),
+                    ),
+                    file_name=f"{export_file_name}.{extension}",
+                    mime=mime,
+                    key=f"{widget_key_base}_export_{extension}",
+                    on_click="ignore",
+                    icon=":material/download:",
                 )
 
-                if search_pattern:
-                    pattern = (
-                        search_pattern
-                        if case_sensitive
-                        else f"(?i){re.escape(search_pattern)}"
-                    )
-                    filtered_df = filtered_df.filter(
-                        pl.col(column)
-                        .cast(pl.String)
-                        .fill_null("")
-                        .str.contains(pattern, literal=case_sensitive)
-                    )
+    return result
+
+
+def _explorer_result(
+    df: pl.DataFrame | pl.LazyFrame,
+    lf: pl.LazyFrame,
+    conditions: list[tuple[str, tuple | None]],
+    pattern_filters: dict[str, pl.Expr],
+    max_rows: int | None,
+    cache_key: Hashable | None,
+) -> pl.DataFrame:
+    if not any(condition is not None for _, condition in conditions):
+        if isinstance(df, pl.DataFrame) and max_rows is None:
+            return df
+    else:
+        lf = lf.filter(combined_filter(conditions, pattern_filters))
+
+    if cache_key is not None:
+        result_key = (cache_key, "rows", filter_spec(conditions), max_rows)
+        result = get_query_cache().get(result_key)
+        if result is not None:
+            return result
+
+    with span("explorer.collect"):
+        result = lf.head(max_rows).collect() if max_rows is not None else lf.collect()
+
+    if cache_key is not None:
+        get_query_cache().put(result_key, result)
+
+    return result
+
+
+def export_frame(df: pl.DataFrame, file_format: str) -> bytes:
+    """Write `df` to CSV or Parquet bytes.
+
+    Polars writes the frame in batches of rows, or row groups, straight from its
+    memory to a temporary file, which is read back once. The export is only held in
+    memory by the returned bytes.
+    """
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(
+            f"Unknown export format {file_format!r}, expected 'csv' or 'parquet'"
+        )
+
+    with tempfile.TemporaryFile() as f:
+        if file_format == "csv":
+            df.write_csv(f, batch_size=_EXPORT_BATCH_ROWS)
+        else:
+            df.write_parquet(f, row_group_size=_EXPORT_BATCH_ROWS)
+        f.seek(0)
+        return f.read()
+
+
+def _deferred_export(
+    df: pl.DataFrame, file_format: str, cache_key: Hashable | None
+) -> Callable[[], bytes]:
+    """Export `df` only when called, memoized in the query cache under `cache_key`."""
+    # The download runs outside of the script thread, so get the cache now
+    cache = get_query_cache() if cache_key is not None else None
+
+    def export() -> bytes:
+        data = cache.get(cache_key) if cache is not None else None
+        if data is None:
+            data = export_frame(df, file_format)
+            if cache is not None:
+                cache.put(cache_key, data)
+        return data
 
-    return filtered_df
+    return export
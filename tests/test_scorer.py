@@ -0,0 +1,65 @@
+"""Parity of the exported model artifact with the pickled Lasso pipeline."""
+
+import pickle
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pytest
+
+from src.export_model import check_parity, targets
+from src.scorer import LinearScorer
+from src.utils import scan_car_data
+
+DATA_PATH = Path(__file__).resolve().parent.parent / "data"
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    with (DATA_PATH / "lasso_regression.pkl").open("rb") as f:
+        return pickle.load(f)  # noqa: S301 artifact of this repository
+
+
+@pytest.fixture(scope="module")
+def scorer() -> LinearScorer:
+    return LinearScorer.load(DATA_PATH / "lasso_regression.json")
+
+
+@pytest.fixture(scope="module")
+def car_data() -> pl.DataFrame:
+    return scan_car_data(DATA_PATH).collect()
+
+
+def test_targets(scorer: LinearScorer) -> None:
+    assert scorer.targets == targets
+
+
+def test_predict_frame_matches_pipeline(scorer, pipeline, car_data) -> None:
+    expected = pipeline.predict(car_data).reshape(len(car_data), -1)
+    np.testing.assert_allclose(
+        scorer.predict_frame(car_data).to_numpy(), expected, rtol=0, atol=1e-6
+    )
+
+
+def test_predict_one_matches_pipeline(scorer, pipeline, car_data) -> None:
+    sample = car_data.sample(500, seed=0)
+    expected = pipeline.predict(sample).reshape(len(sample), -1)
+    single = [
+        scorer.predict_one(row)
+        for row in sample.select(scorer.features).iter_rows(named=True)
+    ]
+    np.testing.assert_allclose(single, expected, rtol=0, atol=1e-6)
+
+
+def test_unknown_category_and_missing_value(scorer, pipeline, car_data) -> None:
+    row = car_data.head(1).with_columns(
+        pl.lit("Unknown make").alias("make"), pl.lit(None, pl.Int32).alias("gears")
+    )
+    expected = pipeline.predict(row).reshape(1, -1)
+    np.testing.assert_allclose(
+        [scorer.predict_one(row.row(0, named=True))], expected, rtol=0, atol=1e-6
+    )
+
+
+def test_check_parity(scorer, pipeline, car_data) -> None:
+    assert check_parity(scorer, pipeline, car_data) <= 1e-6